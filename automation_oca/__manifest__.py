@@ -5,7 +5,7 @@
     "name": "Automation Oca",
     "summary": """
         Automate actions in threaded models""",
-    "version": "18.0.1.0.1",
+    "version": "18.0.1.8.0",
     "license": "AGPL-3",
     "category": "Automation",
     "author": "Dixmit,Odoo Community Association (OCA)",
@@ -19,11 +19,14 @@
         "wizards/automation_configuration_test.xml",
         "views/automation_record.xml",
         "views/automation_record_step.xml",
+        "views/automation_error_signature.xml",
         "views/automation_configuration_step.xml",
         "views/automation_configuration.xml",
         "views/link_tracker_clicks.xml",
         "views/automation_filter.xml",
         "views/automation_tag.xml",
+        "views/automation_mail_rate_limit.xml",
+        "views/automation_funnel_report.xml",
         "data/cron.xml",
     ],
     "assets": {
@@ -39,4 +42,5 @@
     "demo": [
         "demo/demo.xml",
     ],
+    "uninstall_hook": "uninstall_hook",
 }
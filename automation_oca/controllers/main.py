@@ -2,12 +2,21 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+import json
 
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import BadRequest, Forbidden, NotFound
 
-from odoo import http, tools
+from odoo import http
 from odoo.http import Response, request
 from odoo.tools import consteq
+from odoo.tools.lru import LRU
+
+# This is the code of a blank small image
+BLANK_GIF = base64.b64decode(
+    b"R0lGODlhAQABAIAAANvf7wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
+)
+# Steps already opened on this worker, by database
+OPENED_STEPS = LRU(8192)
 
 
 class AutomationOCAController(http.Controller):
@@ -23,23 +32,23 @@ class AutomationOCAController(http.Controller):
     def automation_oca_mail_open(self, record_id, token, **post):
         """Email tracking. Blank item added.
         We will return the blank item allways, but we will make the request only if
-        the data is correct"""
-        if consteq(
-            token,
-            tools.hmac(request.env(su=True), "automation_oca", record_id),
-        ):
-            request.env["automation.record.step"].sudo().browse(
-                record_id
-            )._set_mail_open()
-        response = Response()
-        response.mimetype = "image/gif"
-        response.data = base64.b64decode(
-            b"R0lGODlhAQABAIAAANvf7wAAACH5BAEAAAAALAAAAAABAAEAAAICRAEAOw=="
-            # This is the code of a blank small image
+        the data is correct.
+        Steps already opened on this worker are not registered again, as image
+        proxies usually request the image several times."""
+        key = (request.db, record_id)
+        if key not in OPENED_STEPS and request.env[
+            "automation.record.step"
+        ].sudo()._check_tracking_token(record_id, token):
+            request.env["automation.tracking.event"].sudo()._add_events(
+                [record_id], "open"
+            )
+            OPENED_STEPS[key] = True
+        return Response(
+            BLANK_GIF,
+            mimetype="image/gif",
+            headers=[("Cache-Control", "public, max-age=604800")],
         )
 
-        return response
-
     @http.route(
         "/r/<string:code>/au/<int:record_id>/<string:token>", type="http", auth="public"
     )
@@ -48,9 +57,10 @@ class AutomationOCAController(http.Controller):
         # which mass_mailing doesn't depend on
         country_code = request.geoip.get("country_code")
         automation_record_step_id = False
-        if consteq(
-            token,
-            tools.hmac(request.env(su=True), "automation_oca", record_id),
+        if (
+            request.env["automation.record.step"]
+            .sudo()
+            ._check_tracking_token(record_id, token)
         ):
             automation_record_step_id = record_id
         request.env["link.tracker.click"].sudo().add_click(
@@ -59,7 +69,44 @@ class AutomationOCAController(http.Controller):
             country_code=country_code,
             automation_record_step_id=automation_record_step_id,
         )
-        redirect_url = request.env["link.tracker"].get_url_from_code(code)
+        # The link is cached by the worker, the click has already read it
+        redirect_url = request.env["link.tracker"].sudo()._get_automation_link(code)[1]
         if not redirect_url:
             raise NotFound()
         return request.redirect(redirect_url, code=301, local=False)
+
+    # ------------------------------------------------------------
+    # EXTERNAL EVENTS
+    # ------------------------------------------------------------
+
+    @http.route(
+        "/automation_oca/events",
+        type="http",
+        auth="public",
+        methods=["POST"],
+        csrf=False,
+    )
+    def automation_oca_events(self, **post):
+        """Bulk reception of tracking events reported by an external provider.
+        The body must be a JSON list of events like
+        `{"event": "open", "message_id": "<...>"}` or
+        `{"event": "bounce", "step_id": 1}` and the request must be authenticated
+        with the token of the `automation_oca.webhook_token` parameter as a
+        Bearer token."""
+        webhook_token = (
+            request.env["ir.config_parameter"]
+            .sudo()
+            .get_param("automation_oca.webhook_token")
+        )
+        authorization = request.httprequest.headers.get("Authorization", "")
+        if not webhook_token or not consteq(authorization, f"Bearer {webhook_token}"):
+            raise Forbidden()
+        try:
+            events = json.loads(request.httprequest.get_data())
+        except ValueError as e:
+            raise BadRequest() from e
+        if not isinstance(events, list):
+            raise BadRequest()
+        return request.make_json_response(
+            request.env["automation.tracking.event"].sudo()._add_external_events(events)
+        )
@@ -0,0 +1,17 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tools.sql import SQL
+
+
+def uninstall_hook(env):
+    """
+    The funnel report is a materialized view, that Odoo doesn't remove when
+    uninstalling the module
+    """
+    env.cr.execute(
+        SQL(
+            "DROP MATERIALIZED VIEW IF EXISTS %s",
+            SQL.identifier("automation_funnel_report"),
+        )
+    )
@@ -0,0 +1,53 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    """Move the tracebacks stored on each step to the error signatures.
+
+    Old tracebacks cannot be normalized anymore, so we group them by their
+    full text. Steps keep the last line of the traceback as their message.
+    """
+    cr.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'automation_record_step' AND column_name = 'error_trace'
+        """
+    )
+    if not cr.fetchone():
+        return
+    cr.execute(
+        r"""
+        INSERT INTO automation_error_signature (
+            signature, name, exception_type, error_trace, count,
+            first_seen, last_seen, create_uid, create_date, write_uid, write_date
+        )
+        SELECT
+            md5(error_trace),
+            substring(min(error_trace) from '([^\n]+)\n*$'),
+            split_part(substring(min(error_trace) from '([^\n]+)\n*$'), ':', 1),
+            min(error_trace),
+            count(*),
+            min(processed_on),
+            max(processed_on),
+            1,
+            now() at time zone 'UTC',
+            1,
+            now() at time zone 'UTC'
+        FROM automation_record_step
+        WHERE error_trace IS NOT NULL
+        GROUP BY md5(error_trace)
+        ON CONFLICT (signature) DO NOTHING
+        """
+    )
+    cr.execute(
+        r"""
+        UPDATE automation_record_step step
+        SET error_signature_id = sig.id,
+            error_message = substring(step.error_trace from '([^\n]+)\n*$')
+        FROM automation_error_signature sig
+        WHERE step.error_trace IS NOT NULL
+            AND sig.signature = md5(step.error_trace)
+        """
+    )
+    cr.execute("ALTER TABLE automation_record_step DROP COLUMN error_trace")
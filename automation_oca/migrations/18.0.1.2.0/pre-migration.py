@@ -0,0 +1,17 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    """Remove duplicated automation clicks before creating the unique index"""
+    cr.execute(
+        """
+        DELETE FROM link_tracker_click click
+        USING link_tracker_click other
+        WHERE click.automation_record_step_id IS NOT NULL
+            AND click.automation_record_step_id = other.automation_record_step_id
+            AND click.link_id = other.link_id
+            AND COALESCE(click.ip, '') = COALESCE(other.ip, '')
+            AND click.id > other.id
+        """
+    )
@@ -0,0 +1,10 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    """Fill the dashboard counters with the existing records"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["automation.configuration.counter"]._cron_rebuild()
@@ -0,0 +1,39 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+from odoo.tools.sql import SQL
+
+
+def migrate(cr, version):
+    """Store the name of the documents of the existing records"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cr.execute(
+        """
+        SELECT model, ARRAY_AGG(DISTINCT res_id)
+        FROM automation_record
+        WHERE model IS NOT NULL AND res_id IS NOT NULL
+        GROUP BY model
+        """
+    )
+    for model, res_ids in cr.fetchall():
+        for chunk in cr.split_for_in_conditions(res_ids):
+            names = env["automation.record"]._get_document_names(model, list(chunk))
+            if not names:
+                continue
+            cr.execute(
+                SQL(
+                    """
+                    UPDATE automation_record
+                    SET document_name = document.name
+                    FROM unnest(%(ids)s::int[], %(names)s::varchar[])
+                        AS document(id, name)
+                    WHERE automation_record.model = %(model)s
+                        AND automation_record.res_id = document.id
+                    """,
+                    ids=list(names),
+                    names=list(names.values()),
+                    model=model,
+                )
+            )
+            env.invalidate_all()
@@ -0,0 +1,11 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    """Fill the number of scheduled steps of the existing records"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["automation.record"]._cron_repair_pending_step_count()
+    env.flush_all()
@@ -0,0 +1,25 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    """
+    Remove duplicated rate limits without server before creating the unique
+    index that replaces the constraint
+    """
+    cr.execute(
+        """
+        DELETE FROM automation_mail_rate_limit rate_limit
+        USING automation_mail_rate_limit other
+        WHERE rate_limit.mail_server_id IS NULL
+            AND other.mail_server_id IS NULL
+            AND rate_limit.domain = other.domain
+            AND rate_limit.id > other.id
+        """
+    )
+    cr.execute(
+        """
+        ALTER TABLE automation_mail_rate_limit
+        DROP CONSTRAINT IF EXISTS automation_mail_rate_limit_domain_mail_server_unique
+        """
+    )
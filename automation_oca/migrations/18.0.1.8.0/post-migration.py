@@ -0,0 +1,14 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import SUPERUSER_ID, api
+
+
+def migrate(cr, version):
+    """Counters are compacted more often, so reading them stays fast"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cron = env.ref(
+        "automation_oca.cron_configuration_counter_compact", raise_if_not_found=False
+    )
+    if cron:
+        cron.write({"interval_number": 10, "interval_type": "minutes"})
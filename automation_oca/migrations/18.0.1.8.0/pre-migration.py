@@ -0,0 +1,21 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    """
+    Step statistics are stored as deltas, several rows can share the same
+    configuration step, day and outcome.
+    The name of the unique constraint is truncated, so it is searched.
+    """
+    cr.execute(
+        """
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'automation_configuration_step_stat'::regclass
+            AND contype = 'u'
+        """
+    )
+    for (name,) in cr.fetchall():
+        cr.execute(
+            f'ALTER TABLE automation_configuration_step_stat DROP CONSTRAINT "{name}"'
+        )
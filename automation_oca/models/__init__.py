@@ -1,10 +1,17 @@
 from . import automation_configuration
 from . import automation_configuration_step
+from . import automation_configuration_step_stat
+from . import automation_configuration_counter
 from . import automation_record
 from . import automation_record_step
 from . import mail_mail
+from . import mail_render_mixin
 from . import mail_thread
 from . import link_tracker
 from . import automation_filter
 from . import automation_tag
 from . import mail_activity
+from . import automation_error_signature
+from . import automation_mail_rate_limit
+from . import automation_tracking_event
+from . import automation_funnel_report
@@ -6,6 +6,8 @@ import json
 import uuid
 from collections import defaultdict
 
+from dateutil.relativedelta import relativedelta
+
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 from odoo.tools.safe_eval import (
@@ -77,6 +79,15 @@ class AutomationConfiguration(models.Model):
     is_periodic = fields.Boolean(
         help="Mark it if you want to make the execution periodic"
     )
+    step_limit = fields.Integer(
+        help="Maximum number of steps executed on each period. "
+        "Pending steps will wait for the next period. 0 means no limit."
+    )
+    step_limit_period = fields.Selection(
+        [("cron", "Per cron execution"), ("minute", "Per minute")],
+        default="cron",
+        required=True,
+    )
     # The idea of flow of states will be:
     # draft -> run       -> done -> draft (for periodic execution)
     #       -> on demand -> done -> draft (for on demand execution)
@@ -99,13 +110,13 @@ class AutomationConfiguration(models.Model):
         inverse_name="configuration_id",
         domain=[("parent_id", "=", False)],
     )
-    record_test_count = fields.Integer(compute="_compute_record_test_count")
-    record_count = fields.Integer(compute="_compute_record_count")
-    record_done_count = fields.Integer(compute="_compute_record_count")
-    record_run_count = fields.Integer(compute="_compute_record_count")
-    activity_mail_count = fields.Integer(compute="_compute_activity_count")
-    activity_action_count = fields.Integer(compute="_compute_activity_count")
-    click_count = fields.Integer(compute="_compute_click_count")
+    record_test_count = fields.Integer(compute="_compute_counters")
+    record_count = fields.Integer(compute="_compute_counters")
+    record_done_count = fields.Integer(compute="_compute_counters")
+    record_run_count = fields.Integer(compute="_compute_counters")
+    activity_mail_count = fields.Integer(compute="_compute_counters")
+    activity_action_count = fields.Integer(compute="_compute_counters")
+    click_count = fields.Integer(compute="_compute_counters")
     next_execution_date = fields.Datetime(compute="_compute_next_execution_date")
 
     @api.depends("filter_id.domain", "filter_id", "editable_domain")
@@ -116,63 +127,17 @@ class AutomationConfiguration(models.Model):
             ) or record.editable_domain
 
     @api.depends()
-    def _compute_click_count(self):
-        data = self.env["link.tracker.click"].read_group(
-            [("automation_configuration_id", "in", self.ids)],
-            [],
-            ["automation_configuration_id"],
-            lazy=False,
-        )
-        mapped_data = {d["automation_configuration_id"][0]: d["__count"] for d in data}
-        for record in self:
-            record.click_count = mapped_data.get(record.id, 0)
-
-    @api.depends()
-    def _compute_activity_count(self):
-        data = self.env["automation.record.step"].read_group(
-            [
-                ("configuration_id", "in", self.ids),
-                ("state", "=", "done"),
-                ("is_test", "=", False),
-            ],
-            [],
-            ["configuration_id", "step_type"],
-            lazy=False,
-        )
-        mapped_data = defaultdict(lambda: {})
-        for d in data:
-            mapped_data[d["configuration_id"][0]][d["step_type"]] = d["__count"]
+    def _compute_counters(self):
+        counters = self.env["automation.configuration.counter"]._get_counters(self)
         for record in self:
-            record.activity_mail_count = mapped_data[record.id].get("mail", 0)
-            record.activity_action_count = mapped_data[record.id].get("action", 0)
-
-    @api.depends()
-    def _compute_record_count(self):
-        data = self.env["automation.record"].read_group(
-            [("configuration_id", "in", self.ids), ("is_test", "=", False)],
-            [],
-            ["configuration_id", "state"],
-            lazy=False,
-        )
-        mapped_data = defaultdict(lambda: {})
-        for d in data:
-            mapped_data[d["configuration_id"][0]][d["state"]] = d["__count"]
-        for record in self:
-            record.record_done_count = mapped_data[record.id].get("done", 0)
-            record.record_run_count = mapped_data[record.id].get("periodic", 0)
-            record.record_count = sum(mapped_data[record.id].values())
-
-    @api.depends()
-    def _compute_record_test_count(self):
-        data = self.env["automation.record"].read_group(
-            [("configuration_id", "in", self.ids), ("is_test", "=", True)],
-            [],
-            ["configuration_id"],
-            lazy=False,
-        )
-        mapped_data = {d["configuration_id"][0]: d["__count"] for d in data}
-        for record in self:
-            record.record_test_count = mapped_data.get(record.id, 0)
+            record_counters = counters[record.id]
+            record.record_count = record_counters["record"]
+            record.record_run_count = record_counters["record_run"]
+            record.record_done_count = record_counters["record_done"]
+            record.record_test_count = record_counters["record_test"]
+            record.activity_mail_count = record_counters["activity_mail"]
+            record.activity_action_count = record_counters["activity_action"]
+            record.click_count = record_counters["click"]
 
     @api.depends("model_id")
     def _compute_filter_domain(self):
@@ -191,6 +156,12 @@ class AutomationConfiguration(models.Model):
             else:
                 record.next_execution_date = False
 
+    @api.constrains("step_limit")
+    def _check_step_limit(self):
+        for record in self:
+            if record.step_limit < 0:
+                raise ValidationError(_("The step limit cannot be negative"))
+
     @api.onchange("filter_id")
     def _onchange_filter(self):
         self.model_id = self.filter_id.model_id
@@ -220,6 +191,28 @@ class AutomationConfiguration(models.Model):
         for record in self.search([("state", "=", "periodic")]):
             record.run_automation()
 
+    def _get_step_limit_budget(self):
+        """
+        Number of steps that can be executed now according to the step limit.
+        On minute periods, the steps processed during the last minute are
+        discounted.
+        """
+        self.ensure_one()
+        if self.step_limit_period != "minute":
+            return self.step_limit
+        executed = self.env["automation.record.step"].search_count(
+            [
+                ("configuration_id", "=", self.id),
+                ("state", "in", ["done", "error"]),
+                (
+                    "processed_on",
+                    ">",
+                    fields.Datetime.now() - relativedelta(minutes=1),
+                ),
+            ]
+        )
+        return max(self.step_limit - executed, 0)
+
     def _get_eval_context(self):
         """Prepare the context used when evaluating python code
         :returns: dict -- evaluation context given to safe_eval
@@ -367,6 +360,8 @@ class AutomationConfiguration(models.Model):
             "model_id": self._get_external_xmlid(self.model_id),
             "field_id": self._get_external_xmlid(self.field_id),
             "is_periodic": self.is_periodic,
+            "step_limit": self.step_limit,
+            "step_limit_period": self.step_limit_period,
             "steps": [],
         }
         extra_data = defaultdict(lambda: {})
@@ -588,9 +583,11 @@ class AutomationConfiguration(models.Model):
             ).id,
             "mail_template_id": step_data.get("mail_template_id")
             and self.env.ref(step_data.get("mail_template_id")).id,
+            "mail_send_mode": step_data.get("mail_send_mode", "direct"),
             "server_action_id": step_data.get("server_action_id")
             and self.env.ref(step_data.get("server_action_id")).id,
             "server_context": step_data.get("server_context", "{}"),
+            "execution_timeout": step_data.get("execution_timeout", 0),
             "activity_type_id": step_data.get("activity_type_id")
             and self.env.ref(step_data.get("activity_type_id")).id,
             "activity_summary": step_data.get("activity_summary", ""),
@@ -619,5 +616,7 @@ class AutomationConfiguration(models.Model):
             "model_id": self.env.ref(data.get("model_id")).id,
             "field_id": data.get("field_id") and self.env.ref(data.get("field_id")).id,
             "is_periodic": data.get("is_periodic"),
+            "step_limit": data.get("step_limit", 0),
+            "step_limit_period": data.get("step_limit_period", "cron"),
             "editable_domain": data.get("domain", "[]"),
         }
@@ -0,0 +1,165 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from collections import defaultdict
+
+from odoo import api, fields, models
+from odoo.tools.sql import SQL
+
+# Models that feed the counters. Each one must implement _get_counter_query
+COUNTER_MODELS = ["automation.record", "automation.record.step", "link.tracker.click"]
+# Number of deltas of a counter that triggers the compaction when read
+COMPACT_THRESHOLD = 1000
+
+
+class AutomationConfigurationCounter(models.Model):
+    """
+    Deltas of the counters shown on the dashboard of the configurations.
+    Rows are only inserted, so concurrent transactions never wait on each
+    other, and they are merged periodically.
+    """
+
+    _name = "automation.configuration.counter"
+    _description = "Automation Configuration Counter"
+    _log_access = False
+
+    configuration_id = fields.Many2one(
+        "automation.configuration", required=True, index=True, ondelete="cascade"
+    )
+    counter = fields.Selection(
+        [
+            ("record", "Records"),
+            ("record_run", "Running records"),
+            ("record_done", "Done records"),
+            ("record_test", "Test records"),
+            ("activity_mail", "Emails sent"),
+            ("activity_action", "Actions executed"),
+            ("click", "Clicks"),
+        ],
+        required=True,
+    )
+    count = fields.Integer()
+
+    @api.model
+    def _get_counts(self, records):
+        """Counters of the records by configuration and counter"""
+        if not records.ids:
+            return {}
+        self.env.cr.execute(
+            records._get_counter_query(SQL("id = ANY(%s)", records.ids))
+        )
+        return {
+            (configuration_id, counter): count
+            for configuration_id, counter, count in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _add_counts(self, counts):
+        """
+        Add the deltas to the counters.
+        counts is a mapping of (configuration id, counter) to the value to add.
+        """
+        rows = [(key, value) for key, value in counts.items() if value]
+        if not rows:
+            return
+        self.env.cr.execute(
+            SQL(
+                """
+                INSERT INTO automation_configuration_counter (
+                    configuration_id, counter, count
+                )
+                SELECT * FROM unnest(
+                    %(configuration_ids)s::int[], %(counters)s::varchar[],
+                    %(counts)s::int[]
+                )
+                """,
+                configuration_ids=[key[0] for key, _value in rows],
+                counters=[key[1] for key, _value in rows],
+                counts=[value for _key, value in rows],
+            )
+        )
+
+    @api.model
+    def _get_counters(self, configurations):
+        """Current value of the counters of the configurations"""
+        self.flush_model()
+        for model in COUNTER_MODELS:
+            self.env[model].flush_model()
+        result = defaultdict(lambda: defaultdict(int))
+        compact = False
+        for configuration, counter, count, deltas in self._read_group(
+            [("configuration_id", "in", configurations.ids)],
+            ["configuration_id", "counter"],
+            ["count:sum", "__count"],
+        ):
+            result[configuration.id][counter] = count
+            compact = compact or deltas > COMPACT_THRESHOLD
+        if compact:
+            self._trigger_compact()
+        return result
+
+    @api.model
+    def _trigger_compact(self):
+        """Compact the deltas now, unless it is already planned"""
+        cron = self.env.ref("automation_oca.cron_configuration_counter_compact")
+        if not (
+            self.env["ir.cron.trigger"]
+            .sudo()
+            .search_count(
+                [
+                    ("cron_id", "=", cron.id),
+                    ("call_at", "<=", fields.Datetime.now()),
+                ],
+                limit=1,
+            )
+        ):
+            cron.sudo()._trigger()
+
+    @api.model
+    def _cron_compact(self):
+        """Merge the deltas in a single row by configuration and counter"""
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH deleted AS (
+                    DELETE FROM automation_configuration_counter
+                    RETURNING configuration_id, counter, count
+                )
+                INSERT INTO automation_configuration_counter (
+                    configuration_id, counter, count
+                )
+                SELECT configuration_id, counter, SUM(count)
+                FROM deleted
+                GROUP BY configuration_id, counter
+                HAVING SUM(count) != 0
+                """
+            )
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _cron_rebuild(self):
+        """
+        Compute again the exact value of the counters.
+        Changes done directly on the database, like cascade deletions,
+        are fixed here.
+        """
+        for model in COUNTER_MODELS:
+            self.env[model].flush_model()
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH deleted AS (
+                    DELETE FROM automation_configuration_counter
+                )
+                INSERT INTO automation_configuration_counter (
+                    configuration_id, counter, count
+                )
+                %s
+                """,
+                SQL(" UNION ALL ").join(
+                    self.env[model]._get_counter_query() for model in COUNTER_MODELS
+                ),
+            )
+        )
+        self.invalidate_model()
@@ -1,6 +1,7 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+import functools
 import json
 from collections import defaultdict
 
@@ -14,6 +15,11 @@ from odoo.tools import get_lang
 from odoo.tools.safe_eval import safe_eval
 
 
+@functools.lru_cache(maxsize=512)
+def _format_graph_date(day, lang):
+    return babel.dates.format_date(day, format="dd MMM yyy", locale=lang)
+
+
 class AutomationConfigurationStep(models.Model):
     _name = "automation.configuration.step"
     _description = "Automation Steps"
@@ -87,6 +93,13 @@ class AutomationConfigurationStep(models.Model):
     mail_template_id = fields.Many2one(
         "mail.template", domain="[('model_id', '=', model_id)]"
     )
+    mail_send_mode = fields.Selection(
+        [("direct", "Send directly"), ("queue", "Queue")],
+        default="direct",
+        required=True,
+        help="Queued emails are sent by the email queue. "
+        "The step is marked as sent once the email has been delivered.",
+    )
     server_action_id = fields.Many2one(
         "ir.actions.server", domain="[('model_id', '=', model_id)]"
     )
@@ -153,6 +166,21 @@ class AutomationConfigurationStep(models.Model):
     parent_position = fields.Integer(
         compute="_compute_parent_position", recursive=True, store=True
     )
+    execution_timeout = fields.Integer(
+        help="Maximum time in seconds for the execution of the step. "
+        "If it is exceeded, the step is marked as an error and its changes are "
+        "discarded. Zero means no limit."
+    )
+    duration_avg = fields.Float(
+        compute="_compute_duration",
+        string="Average duration (s)",
+        help="Of the steps processed on the last 14 days",
+    )
+    duration_max = fields.Float(
+        compute="_compute_duration",
+        string="Maximum duration (s)",
+        help="Of the steps processed on the last 14 days",
+    )
     graph_data = fields.Json(compute="_compute_graph_data")
     graph_done = fields.Integer(compute="_compute_total_graph_data")
     graph_error = fields.Integer(compute="_compute_total_graph_data")
@@ -178,89 +206,72 @@ class AutomationConfigurationStep(models.Model):
 
     @api.depends()
     def _compute_graph_data(self):
-        total = self.env["automation.record.step"].read_group(
+        self.env["automation.record.step"].flush_model()
+        today = fields.Date.today()
+        days = [today + relativedelta(days=i - 14) for i in range(0, 15)]
+        data = self.env["automation.configuration.step.stat"]._read_group(
             [
                 ("configuration_step_id", "in", self.ids),
-                (
-                    "processed_on",
-                    ">=",
-                    fields.Date.context_today(self) + relativedelta(days=-14),
-                ),
-                ("is_test", "=", False),
+                ("day", ">=", days[0]),
             ],
-            ["configuration_step_id"],
-            ["configuration_step_id", "processed_on:day"],
-            lazy=False,
+            ["configuration_step_id", "day:day", "outcome"],
+            ["count:sum"],
         )
-        done = self.env["automation.record.step"].read_group(
+        counts = defaultdict(int)
+        for step, day, outcome, count in data:
+            counts[(step.id, day, outcome)] += count
+        lang = get_lang(self.env).code
+        labels = [_format_graph_date(day, lang) for day in days]
+        for record in self:
+            record.graph_data = {
+                outcome: [
+                    {
+                        "x": label[:-5],
+                        "y": counts[(record.id, day, outcome)],
+                        "name": label,
+                    }
+                    for day, label in zip(days, labels, strict=True)
+                ]
+                for outcome in ["error", "done"]
+            }
+
+    @api.depends()
+    def _compute_total_graph_data(self):
+        self.env["automation.record.step"].flush_model()
+        data = self.env["automation.configuration.step.stat"]._read_group(
+            [("configuration_step_id", "in", self.ids)],
+            ["configuration_step_id", "outcome"],
+            ["count:sum"],
+        )
+        counts = {(step.id, outcome): count for step, outcome, count in data}
+        for record in self:
+            record.graph_done = counts.get((record.id, "done"), 0)
+            record.graph_error = counts.get((record.id, "error"), 0)
+
+    @api.depends()
+    def _compute_duration(self):
+        # Only the recent steps are read, as the history can be huge
+        data = self.env["automation.record.step"].read_group(
             [
                 ("configuration_step_id", "in", self.ids),
-                (
-                    "processed_on",
-                    ">=",
-                    fields.Date.context_today(self) + relativedelta(days=-14),
-                ),
-                ("state", "=", "done"),
+                ("processed_on", ">=", fields.Datetime.now() - relativedelta(days=14)),
+                ("state", "in", ["done", "error"]),
                 ("is_test", "=", False),
             ],
+            ["duration_avg:avg(duration)", "duration_max:max(duration)"],
             ["configuration_step_id"],
-            ["configuration_step_id", "processed_on:day"],
             lazy=False,
         )
-        now = fields.Datetime.now()
-        date_map = {
-            babel.dates.format_datetime(
-                now + relativedelta(days=i - 14),
-                format="dd MMM yyy",
-                tzinfo=self._context.get("tz", None),
-                locale=get_lang(self.env).code,
-            ): 0
-            for i in range(0, 15)
-        }
-        result = defaultdict(
-            lambda: {"done": date_map.copy(), "error": date_map.copy()}
-        )
-        for line in total:
-            result[line["configuration_step_id"][0]]["error"][
-                line["processed_on:day"]
-            ] += line["__count"]
-        for line in done:
-            result[line["configuration_step_id"][0]]["done"][
-                line["processed_on:day"]
-            ] += line["__count"]
-            result[line["configuration_step_id"][0]]["error"][
-                line["processed_on:day"]
-            ] -= line["__count"]
+        mapped_data = {d["configuration_step_id"][0]: d for d in data}
         for record in self:
-            graph_info = dict(result[record.id])
-            record.graph_data = {
-                "error": [
-                    {"x": key[:-5], "y": value, "name": key}
-                    for (key, value) in graph_info["error"].items()
-                ],
-                "done": [
-                    {"x": key[:-5], "y": value, "name": key}
-                    for (key, value) in graph_info["done"].items()
-                ],
-            }
+            record.duration_avg = mapped_data.get(record.id, {}).get("duration_avg")
+            record.duration_max = mapped_data.get(record.id, {}).get("duration_max")
 
-    @api.depends()
-    def _compute_total_graph_data(self):
+    @api.constrains("execution_timeout")
+    def _check_execution_timeout(self):
         for record in self:
-            record.graph_done = self.env["automation.record.step"].search_count(
-                [
-                    ("configuration_step_id", "=", record.id),
-                    ("state", "=", "done"),
-                    ("is_test", "=", False),
-                ]
-            )
-            record.graph_error = self.env["automation.record.step"].search_count(
-                [
-                    ("configuration_step_id", "=", record.id),
-                    ("state", "in", ["expired", "rejected", "error", "cancel"]),
-                    ("is_test", "=", False),
-                ]
-            )
+            if record.execution_timeout < 0:
+                raise ValidationError(_("The execution timeout cannot be negative"))
 
     @api.depends("step_type")
     def _compute_activity_info(self):
@@ -530,6 +541,12 @@ class AutomationConfigurationStep(models.Model):
             record._check_configuration()
 
     def _get_record_activity_scheduled_date(self, record, force=False):
+        """
+        Date when the step will be executed for the record.
+        When activating steps, it is called once for all the steps of a
+        configuration step with an empty record of the model only if
+        _is_scheduled_date_record_independent returns True.
+        """
         if not force and self.trigger_type in [
             "mail_open",
             "mail_bounce",
@@ -553,6 +570,19 @@ class AutomationConfigurationStep(models.Model):
             **{self.trigger_interval_type: self.trigger_interval}
         )
 
+    def _is_scheduled_date_record_independent(self):
+        """
+        Checks if the scheduled date is the same for all the records.
+        Overrides of _get_record_activity_scheduled_date are considered to
+        depend on the record unless they override this method too.
+        """
+        self.ensure_one()
+        return (
+            type(self)._get_record_activity_scheduled_date
+            is AutomationConfigurationStep._get_record_activity_scheduled_date
+            and not (self.trigger_date_kind == "date" and self.trigger_date_field_id)
+        )
+
     def _get_expiry_date(self):
         if not self.expiry:
             return False
@@ -595,8 +625,10 @@ class AutomationConfigurationStep(models.Model):
                 self.mail_author_id
             ),
             "mail_template_id": mail_template_id,
+            "mail_send_mode": self.mail_send_mode,
             "server_action_id": server_action_id,
             "server_context": self.server_context,
+            "execution_timeout": self.execution_timeout,
             "activity_type_id": activity_type_id,
             "activity_summary": self.activity_summary,
             "activity_note": self.activity_note,
@@ -0,0 +1,109 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, fields, models
+from odoo.tools.sql import SQL
+
+
+class AutomationConfigurationStepStat(models.Model):
+    """
+    Daily number of processed record steps of each configuration step.
+    Deltas are added when the state of the record steps changes, so graphs
+    don't need to read the record steps.
+    """
+
+    _name = "automation.configuration.step.stat"
+    _description = "Automation Step Daily Statistics"
+    _log_access = False
+    _order = "day DESC"
+
+    configuration_step_id = fields.Many2one(
+        "automation.configuration.step",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    day = fields.Date(required=True)
+    outcome = fields.Selection(
+        [("done", "Done"), ("error", "Error")],
+        required=True,
+        help="Steps that have been processed without being done are errors",
+    )
+    count = fields.Integer()
+
+    @api.model
+    def _add_counts(self, counts):
+        """
+        Add the deltas to the statistics.
+        counts is a mapping of (configuration step id, day, outcome) to the
+        value to add.
+        Rows are only inserted, so concurrent transactions never wait on each
+        other, and they are merged periodically.
+        """
+        rows = [(key, value) for key, value in counts.items() if value]
+        if not rows:
+            return
+        self.env.cr.execute(
+            SQL(
+                """
+                INSERT INTO automation_configuration_step_stat (
+                    configuration_step_id, day, outcome, count
+                )
+                SELECT * FROM unnest(
+                    %(step_ids)s::int[], %(days)s::date[],
+                    %(outcomes)s::varchar[], %(counts)s::int[]
+                )
+                """,
+                step_ids=[key[0] for key, _value in rows],
+                days=[key[1] for key, _value in rows],
+                outcomes=[key[2] for key, _value in rows],
+                counts=[value for _key, value in rows],
+            )
+        )
+
+    @api.model
+    def _cron_compact(self):
+        """Merge the deltas in a single row by configuration step, day and outcome"""
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH deleted AS (
+                    DELETE FROM automation_configuration_step_stat
+                    RETURNING configuration_step_id, day, outcome, count
+                )
+                INSERT INTO automation_configuration_step_stat (
+                    configuration_step_id, day, outcome, count
+                )
+                SELECT configuration_step_id, day, outcome, SUM(count)
+                FROM deleted
+                GROUP BY configuration_step_id, day, outcome
+                HAVING SUM(count) != 0
+                """
+            )
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild(self):
+        """Compute again all the statistics from the record steps"""
+        self.env["automation.record.step"].flush_model()
+        self.env.cr.execute(
+            SQL(
+                """
+                DELETE FROM automation_configuration_step_stat;
+                INSERT INTO automation_configuration_step_stat (
+                    configuration_step_id, day, outcome, count
+                )
+                SELECT
+                    configuration_step_id,
+                    processed_on::date,
+                    CASE WHEN state = 'done' THEN 'done' ELSE 'error' END,
+                    count(*)
+                FROM automation_record_step
+                WHERE %(processed)s
+                GROUP BY 1, 2, 3
+                """,
+                processed=self.env["automation.record.step"]._get_stat_condition(),
+            )
+        )
+        self.invalidate_model()
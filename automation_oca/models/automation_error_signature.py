@@ -0,0 +1,135 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import hashlib
+import traceback
+
+from odoo import api, fields, models
+from odoo.tools.sql import SQL
+
+
+class AutomationErrorSignature(models.Model):
+    _name = "automation.error.signature"
+    _description = "Automation Error Signature"
+    _order = "last_seen DESC"
+
+    name = fields.Char(readonly=True)
+    signature = fields.Char(required=True, readonly=True)
+    exception_type = fields.Char(readonly=True)
+    error_trace = fields.Text(
+        readonly=True, help="Traceback of the first occurrence of this error"
+    )
+    count = fields.Integer(readonly=True)
+    first_seen = fields.Datetime(readonly=True)
+    last_seen = fields.Datetime(readonly=True)
+    record_step_ids = fields.One2many(
+        "automation.record.step", inverse_name="error_signature_id", readonly=True
+    )
+    record_step_error_count = fields.Integer(
+        compute="_compute_record_step_error_count"
+    )
+
+    _sql_constraints = [
+        (
+            "signature_unique",
+            "unique(signature)",
+            "The error signature must be unique",
+        )
+    ]
+
+    @api.depends()
+    def _compute_record_step_error_count(self):
+        data = self.env["automation.record.step"].read_group(
+            [("error_signature_id", "in", self.ids), ("state", "=", "error")],
+            [],
+            ["error_signature_id"],
+            lazy=False,
+        )
+        mapped_data = {d["error_signature_id"][0]: d["__count"] for d in data}
+        for record in self:
+            record.record_step_error_count = mapped_data.get(record.id, 0)
+
+    @api.model
+    def _get_exception_signature(self, exception):
+        """
+        The signature is computed from the type of the exception and its frames
+        (file, line and function). Messages are not considered, as they usually
+        contain data of the record that failed.
+        """
+        digest = hashlib.sha256()
+        seen = set()
+        while exception is not None and id(exception) not in seen:
+            seen.add(id(exception))
+            exception_type = type(exception)
+            digest.update(
+                f"{exception_type.__module__}.{exception_type.__qualname__}\n".encode()
+            )
+            for frame in traceback.extract_tb(exception.__traceback__):
+                digest.update(
+                    f"{frame.filename}:{frame.lineno}:{frame.name}\n".encode()
+                )
+            exception = exception.__cause__ or (
+                None if exception.__suppress_context__ else exception.__context__
+            )
+        return digest.hexdigest()
+
+    @api.model
+    def _register_exception(self, exception):
+        """
+        Returns the signature of the exception, creating it if needed.
+        We use an upsert in order to avoid concurrency issues when the same error
+        happens on several workers at the same time.
+        """
+        exception_type = type(exception).__name__
+        message = str(exception).strip().splitlines()
+        self.env.cr.execute(
+            SQL(
+                """
+                INSERT INTO automation_error_signature (
+                    signature, name, exception_type, error_trace, count,
+                    first_seen, last_seen,
+                    create_uid, create_date, write_uid, write_date
+                )
+                VALUES (
+                    %(signature)s, %(name)s, %(exception_type)s, %(error_trace)s, 1,
+                    %(now)s, %(now)s, %(uid)s, %(now)s, %(uid)s, %(now)s
+                )
+                ON CONFLICT (signature) DO UPDATE SET
+                    count = automation_error_signature.count + 1,
+                    last_seen = EXCLUDED.last_seen,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+                RETURNING id
+                """,
+                signature=self._get_exception_signature(exception),
+                name=f"{exception_type}: {message[0]}" if message else exception_type,
+                exception_type=exception_type,
+                error_trace="".join(traceback.format_exception(exception)),
+                now=fields.Datetime.now(),
+                uid=self.env.uid,
+            )
+        )
+        signature = self.browse(self.env.cr.fetchone()[0])
+        signature.invalidate_recordset(["count", "last_seen"])
+        return signature
+
+    def action_view_record_steps(self):
+        self.ensure_one()
+        action = self.env["ir.actions.act_window"]._for_xml_id(
+            "automation_oca.automation_record_step_act_window"
+        )
+        action.update(
+            {
+                "domain": [("error_signature_id", "=", self.id)],
+                "context": {"search_default_error": 1},
+                "view_mode": "list,form",
+                "views": [(False, "list"), (False, "form")],
+            }
+        )
+        return action
+
+    def retry(self):
+        """
+        Retry all the record steps that failed with these errors
+        """
+        self.record_step_ids.filtered(lambda r: r.state == "error").retry()
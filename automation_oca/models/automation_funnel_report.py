@@ -0,0 +1,146 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import hashlib
+
+from odoo import api, fields, models
+from odoo.tools.sql import SQL
+
+
+class AutomationFunnelReport(models.Model):
+    """
+    Conversion of the steps by day. It is stored on a materialized view that
+    is refreshed periodically, so the analysis never reads the live tables.
+    """
+
+    _name = "automation.funnel.report"
+    _description = "Automation Funnel Report"
+    _auto = False
+    _order = "date DESC"
+
+    configuration_id = fields.Many2one("automation.configuration", readonly=True)
+    configuration_step_id = fields.Many2one(
+        "automation.configuration.step", string="Step", readonly=True
+    )
+    step_type = fields.Selection(
+        selection=lambda r: (
+            r.env["automation.configuration.step"]._fields["step_type"].selection
+        ),
+        readonly=True,
+    )
+    date = fields.Date(readonly=True, help="Date when the steps were processed")
+    processed_count = fields.Integer(string="Processed", readonly=True)
+    done_count = fields.Integer(string="Done", readonly=True)
+    error_count = fields.Integer(string="Errors", readonly=True)
+    rejected_count = fields.Integer(
+        string="Rejected",
+        readonly=True,
+        help="Steps that were rejected, expired or cancelled",
+    )
+    mail_sent_count = fields.Integer(string="Emails sent", readonly=True)
+    mail_open_count = fields.Integer(string="Emails opened", readonly=True)
+    mail_click_count = fields.Integer(string="Emails clicked", readonly=True)
+    mail_reply_count = fields.Integer(string="Emails replied", readonly=True)
+    mail_bounce_count = fields.Integer(string="Emails bounced", readonly=True)
+    click_count = fields.Integer(string="Clicks", readonly=True)
+    activity_done_count = fields.Integer(string="Activities done", readonly=True)
+    activity_cancel_count = fields.Integer(string="Activities cancelled", readonly=True)
+
+    def _query(self):
+        return SQL(
+            """
+            WITH clicks AS (
+                SELECT automation_record_step_id, COUNT(*) AS click_count
+                FROM link_tracker_click
+                WHERE automation_record_step_id IS NOT NULL
+                GROUP BY automation_record_step_id
+            )
+            SELECT
+                MIN(step.id) AS id,
+                step.configuration_id,
+                step.configuration_step_id,
+                step.step_type,
+                step.processed_on::date AS date,
+                COUNT(*) AS processed_count,
+                COUNT(*) FILTER (WHERE step.state = 'done') AS done_count,
+                COUNT(*) FILTER (WHERE step.state = 'error') AS error_count,
+                COUNT(*) FILTER (
+                    WHERE step.state IN ('rejected', 'expired', 'cancel')
+                ) AS rejected_count,
+                COUNT(*) FILTER (
+                    WHERE step.mail_status IN ('sent', 'open', 'reply', 'bounce')
+                ) AS mail_sent_count,
+                COUNT(*) FILTER (
+                    WHERE step.mail_opened_on IS NOT NULL
+                        OR step.mail_status IN ('open', 'reply')
+                ) AS mail_open_count,
+                COUNT(*) FILTER (
+                    WHERE step.mail_clicked_on IS NOT NULL
+                ) AS mail_click_count,
+                COUNT(*) FILTER (WHERE step.mail_status = 'reply') AS mail_reply_count,
+                COUNT(*) FILTER (
+                    WHERE step.mail_status = 'bounce'
+                ) AS mail_bounce_count,
+                COALESCE(SUM(clicks.click_count), 0) AS click_count,
+                COUNT(*) FILTER (
+                    WHERE step.activity_done_on IS NOT NULL
+                ) AS activity_done_count,
+                COUNT(*) FILTER (
+                    WHERE step.activity_cancel_on IS NOT NULL
+                ) AS activity_cancel_count
+            FROM automation_record_step step
+            LEFT JOIN clicks ON clicks.automation_record_step_id = step.id
+            WHERE step.configuration_step_id IS NOT NULL
+                AND step.processed_on IS NOT NULL
+                AND step.is_test IS NOT TRUE
+            GROUP BY
+                step.configuration_id,
+                step.configuration_step_id,
+                step.step_type,
+                step.processed_on::date
+            """
+        )
+
+    def init(self):
+        # The view is only created again when its query changes, as filling it
+        # reads all the processed steps
+        query = self._query()
+        version = hashlib.sha256(repr((query.code, query.params)).encode()).hexdigest()
+        self.env.cr.execute(
+            SQL(
+                "SELECT obj_description(to_regclass(%s), 'pg_class')",
+                self._table,
+            )
+        )
+        if self.env.cr.fetchone()[0] == version:
+            return
+        self.env.cr.execute(
+            SQL(
+                """
+                DROP MATERIALIZED VIEW IF EXISTS %(table)s;
+                CREATE MATERIALIZED VIEW %(table)s AS (%(query)s);
+                CREATE UNIQUE INDEX %(index)s ON %(table)s (id);
+                COMMENT ON MATERIALIZED VIEW %(table)s IS %(version)s;
+                """,
+                table=SQL.identifier(self._table),
+                index=SQL.identifier(f"{self._table}_id_unique"),
+                query=query,
+                version=version,
+            )
+        )
+
+    @api.model
+    def _cron_refresh(self):
+        """
+        Refresh the data of the report. It is refreshed concurrently, so the
+        report can be used meanwhile.
+        """
+        self.env["automation.record.step"].flush_model()
+        self.env["link.tracker.click"].flush_model()
+        self.env.cr.execute(
+            SQL(
+                "REFRESH MATERIALIZED VIEW CONCURRENTLY %s",
+                SQL.identifier(self._table),
+            )
+        )
+        self.invalidate_model()
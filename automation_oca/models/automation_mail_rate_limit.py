@@ -0,0 +1,143 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import _, api, fields, models
+from odoo.exceptions import ValidationError
+from odoo.tools.sql import SQL
+
+PERIOD_SECONDS = {"minute": 60, "hour": 3600}
+
+
+class AutomationMailRateLimit(models.Model):
+    _name = "automation.mail.rate.limit"
+    _description = "Automation Mail Rate Limit"
+    _rec_name = "domain"
+    _order = "domain, mail_server_id"
+
+    domain = fields.Char(required=True, help="Domain of the recipients, like gmail.com")
+    mail_server_id = fields.Many2one(
+        "ir.mail_server",
+        ondelete="cascade",
+        help="Leave it empty to apply it to the emails without a specific server",
+    )
+    rate = fields.Integer(required=True, help="Emails that can be sent on each period")
+    period = fields.Selection(
+        [("minute", "Per minute"), ("hour", "Per hour")],
+        default="minute",
+        required=True,
+    )
+    burst = fields.Integer(
+        help="Maximum number of emails that can be sent at once. "
+        "If empty, the rate will be used."
+    )
+    tokens = fields.Float(readonly=True)
+    last_refill = fields.Datetime(readonly=True)
+
+    def init(self):
+        super().init()
+        # Rate limits without server must be unique too
+        self.env.cr.execute(
+            SQL(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS
+                    automation_mail_rate_limit_domain_mail_server_index
+                ON automation_mail_rate_limit (domain, COALESCE(mail_server_id, 0))
+                """
+            )
+        )
+
+    @api.constrains("rate", "burst")
+    def _check_rate(self):
+        for record in self:
+            if record.rate <= 0:
+                raise ValidationError(_("The rate must be positive"))
+            if record.burst < 0:
+                raise ValidationError(_("The burst cannot be negative"))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get("domain"):
+                vals["domain"] = vals["domain"].strip().lower()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        if vals.get("domain"):
+            vals["domain"] = vals["domain"].strip().lower()
+        return super().write(vals)
+
+    @api.model
+    def _get_rate_limit(self, domain, mail_server):
+        """Rate limit of the domain, the one specific to the server goes first"""
+        rate_limits = self.search(
+            [
+                ("domain", "=", domain),
+                ("mail_server_id", "in", [mail_server.id, False]),
+            ]
+        )
+        return rate_limits.filtered("mail_server_id")[:1] or rate_limits[:1]
+
+    def _take_token(self):
+        """
+        Consumes a token of the bucket.
+        Returns 0 if the token was available, otherwise the number of seconds
+        until the slot reserved for it. Reserved slots are taken from the
+        bucket, that can become negative, so deferred emails are spread
+        according to the rate.
+        The bucket is refilled and consumed in a single statement in order to
+        be safe when several workers send emails at the same time. It is done
+        on its own transaction, so the row is not locked until the end of the
+        execution of the steps.
+        """
+        self.ensure_one()
+        now = fields.Datetime.now()
+        available = SQL(
+            """
+            CASE WHEN last_refill IS NULL THEN COALESCE(NULLIF(burst, 0), rate)
+            ELSE LEAST(
+                COALESCE(NULLIF(burst, 0), rate),
+                tokens + rate * EXTRACT(EPOCH FROM (%(now)s - last_refill))
+                / (CASE period WHEN 'hour' THEN %(hour)s ELSE %(minute)s END)
+            ) END
+            """,
+            now=now,
+            hour=PERIOD_SECONDS["hour"],
+            minute=PERIOD_SECONDS["minute"],
+        )
+        query = SQL(
+            """
+            UPDATE automation_mail_rate_limit
+            SET tokens = %(available)s - 1, last_refill = %(now)s
+            WHERE id = (
+                SELECT id FROM automation_mail_rate_limit
+                WHERE id = %(id)s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING tokens
+            """,
+            available=available,
+            now=now,
+            id=self.id,
+        )
+        with self.env.registry.cursor() as cr:
+            cr.execute(query)
+            row = cr.fetchone()
+        if not row:
+            # The rate limit is locked for a moment by another worker, or it is
+            # not visible yet because it was changed on the current transaction
+            self.env.cr.execute(
+                SQL(
+                    """
+                    SELECT id FROM automation_mail_rate_limit
+                    WHERE id = %s
+                    FOR UPDATE
+                    """,
+                    self.id,
+                )
+            )
+            self.env.cr.execute(query)
+            row = self.env.cr.fetchone()
+        self.invalidate_recordset(["tokens", "last_refill"])
+        if not row or row[0] >= 0:
+            return 0
+        return -row[0] * PERIOD_SECONDS[self.period] / self.rate
@@ -2,22 +2,42 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import logging
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 from odoo import _, api, fields, models
-from odoo.exceptions import AccessError
+from odoo.tools.sql import SQL
+
+from ..utils.query import is_count_over_threshold
 
 _logger = logging.getLogger(__name__)
 
+# Fields that change the counters of the configurations
+COUNTER_FIELDS = {"configuration_id", "state", "is_test"}
+# Prefix of the precommit data with the records whose access was checked.
+# Checks are kept until the end of the transaction, so changes done later on
+# the access rights, the groups or the documents themselves are not seen by
+# the transaction. Changes of the documents of the records must call
+# _clear_check_access.
+CHECK_ACCESS_KEY = "automation.record.check_access"
+
 
 class AutomationRecord(models.Model):
     _name = "automation.record"
     _description = "Automation Record"
 
-    name = fields.Char(compute="_compute_name")
+    name = fields.Char(compute="_compute_name", search="_search_name")
+    document_name = fields.Char(
+        string="Document (at creation)",
+        readonly=True,
+        index="trigram",
+        help="Name of the document when the record was created",
+    )
     state = fields.Selection(
         [("run", "Running"), ("done", "Done")], compute="_compute_state", store=True
     )
+    pending_step_count = fields.Integer(
+        default=0, readonly=True, help="Number of scheduled steps of the record"
+    )
     configuration_id = fields.Many2one(
         "automation.configuration", required=True, readonly=True
     )
@@ -55,14 +75,10 @@ class AutomationRecord(models.Model):
             .search([("is_mail_thread", "=", True)])
         ]
 
-    @api.depends("automation_step_ids.state")
+    @api.depends("pending_step_count")
     def _compute_state(self):
         for record in self:
-            record.state = (
-                "run"
-                if record.automation_step_ids.filtered(lambda r: r.state == "scheduled")
-                else "done"
-            )
+            record.state = "run" if record.pending_step_count > 0 else "done"
 
     @api.depends("model", "res_id")
     def _compute_resource_ref(self):
@@ -72,13 +88,31 @@ class AutomationRecord(models.Model):
             else:
                 record.resource_ref = None
 
-    @api.depends("res_id", "model")
+    @api.depends("res_id", "model", "is_orphan_record")
     def _compute_name(self):
-        for record in self:
-            if not record.is_orphan_record:
-                record.name = self.env[record.model].browse(record.res_id).display_name
-            else:
-                record.name = _("Orphan Record")
+        for model, records in self.grouped("model").items():
+            # Names of the documents of each model are fetched at once
+            names = self._get_document_names(
+                model,
+                records.filtered(lambda r: not r.is_orphan_record).mapped("res_id"),
+            )
+            for record in records:
+                if record.is_orphan_record or record.res_id not in names:
+                    record.name = _("Orphan Record")
+                else:
+                    record.name = names[record.res_id]
+
+    def _search_name(self, operator, value):
+        # The current name is not stored, the name at creation is used
+        return [("document_name", operator, value)]
+
+    @api.model
+    def _get_document_names(self, model, res_ids):
+        """Display names of the documents by id"""
+        if not model or model not in self.env or not res_ids:
+            return {}
+        documents = self.env[model].browse(res_ids).exists()
+        return {document.id: document.display_name for document in documents}
 
     @api.model
     def _search(
@@ -97,84 +131,136 @@ class AutomationRecord(models.Model):
         if self.env.is_superuser():
             # restrictions do not apply for the superuser
             return query
-
-        # TODO highlight orphaned EDI records in UI:
-        #  - self.model + self.res_id are set
-        #  - self.record returns empty recordset
-        # Remark: self.record is @property, not field
-
         if query.is_empty():
             return query
-        orig_ids = list(query)
-        ids = set(orig_ids)
-        result = []
-        model_data = defaultdict(lambda: defaultdict(set))
-        sub_query = """
-            SELECT id, res_id, model
-            FROM %(table)s
-            WHERE id = ANY (%%(ids)s)
+        query.add_where(self._get_access_condition(self._get_document_models()))
+        return query
+
+    @api.model
+    def _get_document_models(self):
+        """Models of the documents that can be related to the records"""
+        return set(
+            self.env["automation.configuration"]
+            .sudo()
+            .with_context(active_test=False)
+            .search([])
+            .mapped("model")
+        )
+
+    @api.model
+    def _get_access_condition(self, models):
         """
-        for sub_ids in self._cr.split_for_in_conditions(ids):
-            self._cr.execute(
-                sub_query % {"table": self._table},
-                dict(ids=list(sub_ids)),
+        Condition of the records that the user can read.
+        Access to a record is granted when the user can read the related
+        document, so we add a subquery for each model that applies its rules.
+        """
+        model_field = SQL.identifier(self._table, "model")
+        res_id_field = SQL.identifier(self._table, "res_id")
+        conditions = [SQL("%s IS NULL", model_field)]
+        if self.env.is_system():
+            # Group "Settings" can list records whose document is deleted
+            conditions.append(
+                SQL("%s", SQL.identifier(self._table, "is_orphan_record"))
             )
-            for eid, res_id, model in self._cr.fetchall():
-                if not model:
-                    result.append(eid)
-                    continue
-                model_data[model][res_id].add(eid)
-
-        for model, targets in model_data.items():
-            try:
-                self.env[model].check_access("read")
-            except AccessError:  # no read access rights
+        for model in sorted(models):
+            if model not in self.env or not self.env[model].has_access("read"):
                 continue
-            recs = self.env[model].browse(list(targets))
-            missing = recs - recs.exists()
-            if missing:
-                for res_id in missing.ids:
-                    _logger.warning(
-                        "Deleted record %s,%s is referenced by automation.record %s",
-                        model,
-                        res_id,
-                        list(targets[res_id]),
-                    )
-                    self.sudo().search(
-                        [("model", "=", model), ("res_id", "=", res_id)]
-                    ).write(
-                        {
-                            "is_orphan_record": True,
-                            "res_id": False,
-                        }
+            model_query = self.env[model].with_context(active_test=False)._search([])
+            conditions.append(
+                SQL(
+                    "(%s = %s AND %s IN %s)",
+                    model_field,
+                    model,
+                    res_id_field,
+                    model_query.subselect(),
+                )
+            )
+        return SQL("(%s)", SQL(" OR ").join(conditions))
+
+    @api.model
+    def _flag_orphan_records(self, model):
+        """Flag the records of the model whose document has been deleted"""
+        self.env.cr.execute(
+            SQL(
+                """
+                UPDATE automation_record
+                SET is_orphan_record = TRUE, res_id = NULL
+                WHERE automation_record.model = %(model)s
+                    AND automation_record.res_id IS NOT NULL
+                    AND NOT EXISTS (
+                        SELECT 1 FROM %(table)s document
+                        WHERE document.id = automation_record.res_id
                     )
-                recs = recs - missing
-            allowed = list(
-                self.env[model]
-                .with_context(active_test=False)
-                ._search([("id", "in", recs.ids)])
+                RETURNING id
+                """,
+                model=model,
+                table=SQL.identifier(self.env[model]._table),
             )
-            if self.env.is_system():
-                # Group "Settings" can list exchanges where record is deleted
-                allowed.extend(missing.ids)
-            for target_id in allowed:
-                result += list(targets.get(target_id, {}))
-        if len(orig_ids) == limit and len(result) < len(orig_ids):
-            extend_query = self._search(
+        )
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        if ids:
+            _logger.warning(
+                "Deleted records of %s are referenced by automation.record %s",
+                model,
+                ids,
+            )
+            orphans = self.browse(ids)
+            orphans.invalidate_recordset(["is_orphan_record", "res_id"])
+            orphans._clear_check_access()
+        return self.browse(ids)
+
+    @api.model
+    def _cron_flag_orphan_records(self):
+        """
+        Flag the records whose document has been deleted and cancel their
+        scheduled steps, as they cannot be executed anymore.
+        """
+        self.flush_model(["model", "res_id"])
+        orphans = self.browse()
+        for model in self._get_document_models():
+            if model in self.env and not self.env[model]._abstract:
+                orphans |= self._flag_orphan_records(model)
+        if orphans:
+            self.env["automation.record.step"].search(
+                [("record_id", "in", orphans.ids), ("state", "=", "scheduled")]
+            ).cancel()
+
+    @api.model
+    def web_search_read(
+        self, domain, specification, offset=0, limit=None, order=None, count_limit=None
+    ):
+        """
+        On large lists, the count is not computed and the count limit sent by
+        the web client is returned, so it shows it as "count_limit+" and the
+        exact count is computed only when the user clicks on it.
+        """
+        # The estimation includes the access to the documents, so users that
+        # can read few documents still get an exact count
+        if (
+            count_limit
+            and limit
+            and is_count_over_threshold(self.env, self._search(domain))
+        ):
+            # A full page reaches the count limit, so no count is done
+            result = super().web_search_read(
                 domain,
-                offset=offset + len(orig_ids),
+                specification,
+                offset=offset,
                 limit=limit,
                 order=order,
+                count_limit=offset + limit,
             )
-            extend_ids = list(extend_query)
-            result.extend(extend_ids[: limit - len(result)])
-
-        # Restore original ordering
-        result = [x for x in orig_ids if x in result]
-        if set(orig_ids) != set(result):
-            # Create a virgin query
-            query = self.browse(result)._as_query()
-        return query
+            if len(result["records"]) == limit:
+                result["length"] = max(count_limit, result["length"])
+            return result
+        return super().web_search_read(
+            domain,
+            specification,
+            offset=offset,
+            limit=limit,
+            order=order,
+            count_limit=count_limit,
+        )
 
     def read(self, fields=None, load="_classic_read"):
         """Override to explicitely call check_access_rule, that is not called
@@ -188,25 +274,159 @@ class AutomationRecord(models.Model):
         super().check_access(operation)
         if self.env.is_superuser():
             return
+        # Records already checked on the transaction are not checked again
+        companies = ",".join(str(id_) for id_ in sorted(self.env.companies.ids))
+        checked = self.env.cr.precommit.data.setdefault(
+            f"{CHECK_ACCESS_KEY}.{self.env.uid}.{companies}.{operation}", set()
+        )
+        todo = self.sudo().browse([id_ for id_ in self.ids if id_ not in checked])
+        if not todo:
+            return
         default_checker = self.env["mail.thread"].get_automation_access
-        by_model_rec_ids = defaultdict(set)
-        by_model_checker = {}
-        for exc_rec in self.sudo():
-            by_model_rec_ids[exc_rec.model].add(exc_rec.res_id)
-            if exc_rec.model not in by_model_checker:
-                by_model_checker[exc_rec.model] = getattr(
-                    self.env[exc_rec.model], "get_automation_access", default_checker
-                )
-
-        for model, rec_ids in by_model_rec_ids.items():
-            records = self.env[model].browse(rec_ids).with_user(self._uid)
-            checker = by_model_checker[model]
-            for record in records:
-                check_operation = checker(
-                    [record.id], operation, model_name=record._name
-                )
-                record.check_access(check_operation)
+        for model, records in todo.grouped("model").items():
+            res_ids = list(set(records.mapped("res_id")) - {False})
+            if not model or not res_ids:
+                continue
+            checker = getattr(self.env[model], "get_automation_access", default_checker)
+            check_operation = checker(res_ids, operation, model_name=model)
+            self.env[model].browse(res_ids).with_user(self._uid).check_access(
+                check_operation
+            )
+        checked.update(todo.ids)
 
     def write(self, vals):
         self.check_access("write")
+        if "model" in vals or "res_id" in vals:
+            self._clear_check_access()
         return super().write(vals)
+
+    def _clear_check_access(self):
+        """The checks done on the previous documents are not valid anymore"""
+        for key, checked in self.env.cr.precommit.data.items():
+            if isinstance(key, str) and key.startswith(CHECK_ACCESS_KEY):
+                checked.difference_update(self.ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res_ids_by_model = defaultdict(list)
+        for vals in vals_list:
+            if vals.get("model") and vals.get("res_id"):
+                res_ids_by_model[vals["model"]].append(vals["res_id"])
+        names = {
+            model: self._get_document_names(model, res_ids)
+            for model, res_ids in res_ids_by_model.items()
+        }
+        for vals in vals_list:
+            if vals.get("model") and "document_name" not in vals:
+                vals["document_name"] = names.get(vals["model"], {}).get(
+                    vals.get("res_id")
+                )
+        records = super().create(vals_list)
+        counter = self.env["automation.configuration.counter"]
+        counter._add_counts(counter._get_counts(records))
+        return records
+
+    def _write(self, vals):
+        if not COUNTER_FIELDS.intersection(vals):
+            return super()._write(vals)
+        counter = self.env["automation.configuration.counter"]
+        previous_counts = counter._get_counts(self)
+        result = super()._write(vals)
+        counts = Counter(counter._get_counts(self))
+        counts.subtract(previous_counts)
+        counter._add_counts(counts)
+        return result
+
+    def unlink(self):
+        self.flush_recordset()
+        counter = self.env["automation.configuration.counter"]
+        counts = Counter()
+        counts.subtract(counter._get_counts(self))
+        # Steps are removed by the database, so they are not notified
+        counts.subtract(counter._get_counts(self.automation_step_ids))
+        counter._add_counts(counts)
+        return super().unlink()
+
+    @api.model
+    def _add_pending_step_counts(self, counts):
+        """
+        Add the deltas to the number of scheduled steps of the records.
+        counts is a mapping of record id to the value to add.
+        """
+        # Sorted in order to avoid deadlocks between concurrent transactions
+        rows = sorted((key, value) for key, value in counts.items() if key and value)
+        if not rows:
+            return
+        records = self.browse([key for key, _value in rows])
+        records.flush_recordset(["pending_step_count"])
+        self.env.cr.execute(
+            SQL(
+                """
+                UPDATE automation_record
+                SET pending_step_count = COALESCE(pending_step_count, 0) + delta.value
+                FROM unnest(%(ids)s::int[], %(values)s::int[]) AS delta(id, value)
+                WHERE automation_record.id = delta.id
+                """,
+                ids=records.ids,
+                values=[value for _key, value in rows],
+            )
+        )
+        records.invalidate_recordset(["pending_step_count"])
+        records.modified(["pending_step_count"])
+
+    @api.model
+    def _cron_repair_pending_step_count(self):
+        """
+        Verify the number of scheduled steps of the records and fix the
+        ones that don't match.
+        """
+        self.env["automation.record.step"].flush_model(["record_id", "state"])
+        self.flush_model(["pending_step_count"])
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH expected AS (
+                    SELECT record.id, COUNT(step.id) AS count
+                    FROM automation_record record
+                    LEFT JOIN automation_record_step step
+                        ON step.record_id = record.id AND step.state = 'scheduled'
+                    GROUP BY record.id
+                )
+                UPDATE automation_record
+                SET pending_step_count = expected.count
+                FROM expected
+                WHERE automation_record.id = expected.id
+                    AND automation_record.pending_step_count
+                        IS DISTINCT FROM expected.count
+                RETURNING automation_record.id
+                """
+            )
+        )
+        records = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if records:
+            _logger.warning(
+                "Fixed the number of scheduled steps of %s automation records",
+                len(records),
+            )
+            records.invalidate_recordset(["pending_step_count"])
+            records.modified(["pending_step_count"])
+        return records
+
+    @api.model
+    def _get_counter_query(self, condition=None):
+        """Query of the counters of the records by configuration"""
+        return SQL(
+            """
+            SELECT configuration_id, counter, COUNT(*)
+            FROM automation_record, LATERAL unnest(
+                CASE
+                    WHEN is_test THEN ARRAY['record_test']
+                    WHEN state IS NULL THEN ARRAY['record']
+                    ELSE ARRAY['record', 'record_' || state]
+                END
+            ) AS counter
+            WHERE configuration_id IS NOT NULL AND %s
+            GROUP BY configuration_id, counter
+            """,
+            condition or SQL("TRUE"),
+        )
@@ -1,16 +1,31 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import hashlib
+import hmac
 import json
+import math
 import threading
-import traceback
-from io import StringIO
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 
 import werkzeug.urls
 from dateutil.relativedelta import relativedelta
+from psycopg2.errors import QueryCanceled
 
 from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
+from odoo.osv import expression
 from odoo.tools.safe_eval import safe_eval
+from odoo.tools.sql import SQL
+
+from ..utils.query import is_count_over_threshold
+
+# Fields that change the statistics of the configuration steps
+STAT_FIELDS = {"state", "processed_on", "configuration_step_id", "is_test"}
+STAT_STATES = {"done", "expired", "rejected", "error", "cancel"}
+# Fields that change the counters of the configurations
+COUNTER_FIELDS = {"state", "configuration_id", "step_type", "is_test"}
 
 
 class AutomationRecordStep(models.Model):
@@ -37,6 +52,20 @@ class AutomationRecordStep(models.Model):
     do_not_wait = fields.Boolean()
     expiry_date = fields.Datetime(readonly=True)
     processed_on = fields.Datetime(readonly=True)
+    duration = fields.Float(readonly=True, help="Execution time in seconds")
+    backpressure_date = fields.Datetime(
+        readonly=True,
+        help="First time the step was deferred because the email queue was full",
+    )
+    backpressure_delay = fields.Float(
+        readonly=True,
+        help="Time in seconds the step was deferred because the email queue was full",
+    )
+    rate_limit_reserved = fields.Boolean(
+        readonly=True,
+        help="The step was deferred to the slot it reserved on the rate limit of "
+        "the recipient domain",
+    )
     parent_id = fields.Many2one("automation.record.step", readonly=True)
     child_ids = fields.One2many("automation.record.step", inverse_name="parent_id")
     trigger_type = fields.Selection(
@@ -61,15 +90,20 @@ class AutomationRecordStep(models.Model):
         default="scheduled",
         readonly=True,
     )
-    error_trace = fields.Text(readonly=True)
+    error_signature_id = fields.Many2one(
+        "automation.error.signature", readonly=True, index="btree_not_null"
+    )
+    error_message = fields.Text(readonly=True)
+    error_trace = fields.Text(related="error_signature_id.error_trace")
     parent_position = fields.Integer(
         compute="_compute_parent_position", recursive=True, store=True
     )
 
     # Mailing fields
-    message_id = fields.Char(readonly=True)
+    message_id = fields.Char(readonly=True, index="btree_not_null")
     mail_status = fields.Selection(
         [
+            ("queue", "Queued"),
             ("sent", "Sent"),
             ("open", "Opened"),
             ("bounce", "Bounced"),
@@ -85,6 +119,167 @@ class AutomationRecordStep(models.Model):
     is_test = fields.Boolean(related="record_id.is_test", store=True)
     step_actions = fields.Json(compute="_compute_step_actions")
 
+    def init(self):
+        super().init()
+        # Recent durations of the configuration steps are aggregated
+        self.env.cr.execute(
+            SQL(
+                """
+                CREATE INDEX IF NOT EXISTS
+                    automation_record_step_configuration_step_processed_on_index
+                ON automation_record_step (configuration_step_id, processed_on)
+                WHERE processed_on IS NOT NULL
+                """
+            )
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if any(vals.get("processed_on") for vals in vals_list):
+            self.env["automation.configuration.step.stat"]._add_counts(
+                records._get_stat_counts()
+            )
+        counter = self.env["automation.configuration.counter"]
+        counter._add_counts(counter._get_counts(records))
+        self.env["automation.record"]._add_pending_step_counts(
+            records._get_pending_step_counts()
+        )
+        return records
+
+    def write(self, vals):
+        update_stats = bool(STAT_FIELDS.intersection(vals))
+        update_pending = "state" in vals or "record_id" in vals
+        if not update_stats and not update_pending:
+            return super().write(vals)
+        # Deltas are computed from the values before and after writing
+        stats = Counter()
+        counts = Counter()
+        if update_stats:
+            stats.subtract(self._get_stat_counts())
+        if update_pending:
+            counts.subtract(self._get_pending_step_counts())
+        result = super().write(vals)
+        if update_stats:
+            stats.update(self._get_stat_counts())
+            self.env["automation.configuration.step.stat"]._add_counts(stats)
+        if update_pending:
+            counts.update(self._get_pending_step_counts())
+            self.env["automation.record"]._add_pending_step_counts(counts)
+        return result
+
+    def _write(self, vals):
+        if not COUNTER_FIELDS.intersection(vals):
+            return super()._write(vals)
+        counter = self.env["automation.configuration.counter"]
+        previous_counts = counter._get_counts(self)
+        result = super()._write(vals)
+        counts = Counter(counter._get_counts(self))
+        counts.subtract(previous_counts)
+        counter._add_counts(counts)
+        return result
+
+    def unlink(self):
+        stats = Counter()
+        stats.subtract(self._get_stat_counts())
+        self.env["automation.configuration.step.stat"]._add_counts(stats)
+        self.flush_recordset()
+        counter = self.env["automation.configuration.counter"]
+        counts = Counter()
+        counts.subtract(counter._get_counts(self))
+        counter._add_counts(counts)
+        pending_counts = Counter()
+        pending_counts.subtract(self._get_pending_step_counts())
+        self.env["automation.record"]._add_pending_step_counts(pending_counts)
+        return super().unlink()
+
+    def _get_pending_step_counts(self):
+        """Number of scheduled steps by record"""
+        return Counter(step.record_id.id for step in self if step.state == "scheduled")
+
+    @api.model
+    def _get_counter_query(self, condition=None):
+        """Query of the counters of the done steps by configuration"""
+        return SQL(
+            """
+            SELECT configuration_id, 'activity_' || step_type, COUNT(*)
+            FROM automation_record_step
+            WHERE configuration_id IS NOT NULL
+                AND state = 'done'
+                AND step_type IN ('mail', 'action')
+                AND is_test IS NOT TRUE
+                AND %s
+            GROUP BY configuration_id, step_type
+            """,
+            condition or SQL("TRUE"),
+        )
+
+    @api.model
+    def _get_stat_condition(self):
+        """Condition of the steps that are considered on the statistics"""
+        return SQL(
+            """
+            configuration_step_id IS NOT NULL
+            AND processed_on IS NOT NULL
+            AND state IN %(states)s
+            AND is_test IS NOT TRUE
+            """,
+            states=tuple(STAT_STATES),
+        )
+
+    def _get_stat_counts(self):
+        """
+        Number of steps by configuration step, day and outcome.
+        It must match _get_stat_condition.
+        """
+        return Counter(
+            (
+                step.configuration_step_id.id,
+                step.processed_on.date(),
+                "done" if step.state == "done" else "error",
+            )
+            for step in self
+            if step.configuration_step_id
+            and step.processed_on
+            and step.state in STAT_STATES
+            and not step.is_test
+        )
+
+    @api.model
+    def web_search_read(
+        self, domain, specification, offset=0, limit=None, order=None, count_limit=None
+    ):
+        """
+        On large lists, the count is not computed and the count limit sent by
+        the web client is returned, so it shows it as "count_limit+" and the
+        exact count is computed only when the user clicks on it.
+        """
+        if (
+            count_limit
+            and limit
+            and is_count_over_threshold(self.env, self._search(domain))
+        ):
+            # A full page reaches the count limit, so no count is done
+            result = super().web_search_read(
+                domain,
+                specification,
+                offset=offset,
+                limit=limit,
+                order=order,
+                count_limit=offset + limit,
+            )
+            if len(result["records"]) == limit:
+                result["length"] = max(count_limit, result["length"])
+            return result
+        return super().web_search_read(
+            domain,
+            specification,
+            offset=offset,
+            limit=limit,
+            order=order,
+            count_limit=count_limit,
+        )
+
     @api.depends("configuration_step_id")
     def _compute_step_data(self):
         for record in self.filtered(lambda r: r.configuration_step_id):
@@ -156,26 +351,174 @@ class AutomationRecordStep(models.Model):
         ):
             self._reject()
             return self.browse()
+        if not self._check_mail_backpressure() or not self._check_mail_rate_limit():
+            return self.browse()
+        if self.backpressure_date:
+            self.backpressure_delay = (
+                fields.Datetime.now() - self.backpressure_date
+            ).total_seconds()
+        start = time.monotonic()
         try:
-            result = getattr(self, f"_run_{self.configuration_step_id.step_type}")()
-            self.write({"state": "done", "processed_on": fields.Datetime.now()})
+            with self._execution_guard(self.configuration_step_id.execution_timeout):
+                result = getattr(self, f"_run_{self.configuration_step_id.step_type}")()
+            self.write(
+                {
+                    "state": "done",
+                    "processed_on": fields.Datetime.now(),
+                    "duration": time.monotonic() - start,
+                }
+            )
             if result:
                 childs = self._fill_childs()
                 if trigger_activity:
                     childs._trigger_activities()
                 return childs
-        except Exception:
-            buff = StringIO()
-            traceback.print_exc(file=buff)
-            traceback_txt = buff.getvalue()
-            self.write(
+        except Exception as e:
+            self._set_error(e, duration=time.monotonic() - start)
+        return self.browse()
+
+    @contextmanager
+    def _execution_guard(self, timeout):
+        """
+        Enforce the timeout of the step. Every query is limited with a statement
+        timeout and the whole execution is checked against the wall clock once
+        finished. If the limit is exceeded, all the changes done by the step are
+        rolled back and a TimeoutError is raised.
+        """
+        if not timeout:
+            yield
+            return
+        self.env.cr.execute("SHOW statement_timeout")
+        previous_timeout = self.env.cr.fetchone()[0]
+        start = time.monotonic()
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute(
+                    SQL("SET LOCAL statement_timeout = %s", int(timeout * 1000))
+                )
+                yield
+                self.env.flush_all()
+                if time.monotonic() - start > timeout:
+                    raise TimeoutError(
+                        _(
+                            "Step execution exceeded the timeout of %(timeout)s "
+                            "seconds",
+                            timeout=timeout,
+                        )
+                    )
+        except QueryCanceled as e:
+            raise TimeoutError(
+                _(
+                    "Step execution exceeded the timeout of %(timeout)s seconds",
+                    timeout=timeout,
+                )
+            ) from e
+        finally:
+            self.env.cr.execute(
+                SQL("SET LOCAL statement_timeout = %s", previous_timeout)
+            )
+
+    def _check_mail_backpressure(self):
+        """
+        Mail steps wait while the email queue is full, even if they were
+        selected before the queue was filled or they don't wait for the cron.
+        """
+        if self.step_type != "mail" or not self._is_mail_queue_full():
+            return True
+        if not self.backpressure_date:
+            self.backpressure_date = fields.Datetime.now()
+        self._create_backpressure_trigger()
+        return False
+
+    @api.model
+    def _create_backpressure_trigger(self):
+        """
+        Wake up the cron once the email queue has been processed.
+        A single trigger is created by transaction.
+        """
+        if self.env.cr.precommit.data.get("automation_oca.backpressure_trigger"):
+            return
+        self.env.cr.precommit.data["automation_oca.backpressure_trigger"] = True
+        self.env["ir.cron.trigger"].create(
+            {
+                "call_at": fields.Datetime.now() + relativedelta(minutes=5),
+                "cron_id": self.env.ref("automation_oca.cron_step_execute").id,
+            }
+        )
+
+    def _check_mail_rate_limit(self):
+        """
+        Mail steps consume a token of the rate limit of the recipient domain.
+        If no token is available, the step reserves the next free slot of the
+        rate limit and it is rescheduled to it. The cron is woken up by
+        _create_deferred_trigger.
+        """
+        if self.step_type != "mail" or self.is_test or self.rate_limit_reserved:
+            return True
+        record = self.record_id.resource_ref
+        email_field = record._mail_get_primary_email_field()
+        email = tools.email_normalize(email_field and record[email_field] or "")
+        if not email:
+            return True
+        rate_limit = (
+            self.env["automation.mail.rate.limit"]
+            .sudo()
+            ._get_rate_limit(
+                tools.email_domain_extract(email),
+                self.configuration_step_id.mail_template_id.mail_server_id,
+            )
+        )
+        if not rate_limit:
+            return True
+        delay = rate_limit._take_token()
+        if not delay:
+            return True
+        self.write(
+            {
+                "scheduled_date": fields.Datetime.now()
+                + relativedelta(seconds=math.ceil(delay)),
+                "rate_limit_reserved": True,
+            }
+        )
+        return False
+
+    @api.model
+    def _create_deferred_trigger(self):
+        """
+        Wake up the cron when the first step deferred by a rate limit must be
+        executed. A single trigger is created, the next one will be created by
+        that execution of the cron.
+        """
+        step = self.search(
+            [
+                ("state", "=", "scheduled"),
+                ("rate_limit_reserved", "=", True),
+                ("scheduled_date", ">", fields.Datetime.now()),
+            ],
+            order="scheduled_date",
+            limit=1,
+        )
+        if step:
+            self.env["ir.cron.trigger"].create(
                 {
-                    "state": "error",
-                    "error_trace": traceback_txt,
-                    "processed_on": fields.Datetime.now(),
+                    "call_at": step.scheduled_date,
+                    "cron_id": self.env.ref("automation_oca.cron_step_execute").id,
                 }
             )
-        return self.browse()
+
+    def _set_error(self, exception, **kwargs):
+        self.write(
+            {
+                "state": "error",
+                "error_signature_id": self.env["automation.error.signature"]
+                .sudo()
+                ._register_exception(exception)
+                .id,
+                "error_message": str(exception),
+                "processed_on": fields.Datetime.now(),
+                **kwargs,
+            }
+        )
 
     def _reject(self):
         self.write({"state": "rejected", "processed_on": fields.Datetime.now()})
@@ -225,6 +568,9 @@ class AutomationRecordStep(models.Model):
             "template_id": self.configuration_step_id.mail_template_id.id,
             "automation_record_step_id": self.id,
         }
+        if self.configuration_step_id.mail_send_mode == "queue":
+            # The email queue cron will send it
+            composer_values["force_send"] = False
         if self.configuration_step_id.mail_author_id:
             composer_values["author_id"] = self.configuration_step_id.mail_author_id.id
             composer_values["email_from"] = (
@@ -237,17 +583,59 @@ class AutomationRecordStep(models.Model):
             .create(composer_values)
         )
         extra_context = self._run_mail_context()
-        composer = composer.with_context(active_ids=res_ids, **extra_context)
-        # auto-commit except in testing mode
-        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        composer = composer.with_context(
+            active_ids=res_ids, automation_shorten_links=True, **extra_context
+        )
+        # auto-commit except in testing mode or when the step has a timeout, as
+        # committing would release the savepoint used to enforce it
+        auto_commit = (
+            not getattr(threading.current_thread(), "testing", False)
+            and not self.configuration_step_id.execution_timeout
+        )
         if not self.is_test:
             # We just abort the sending, but we want to check how the generation works
             composer._action_send_mail(auto_commit=auto_commit)
-        self.mail_status = "sent"
+        self.mail_status = (
+            "queue"
+            if self.configuration_step_id.mail_send_mode == "queue" and not self.is_test
+            else "sent"
+        )
         return True
 
+    @api.model
+    def _search_message_ids(self, message_ids):
+        """
+        Steps that sent the emails with these message ids.
+        Message ids generated by other servers cannot belong to a step,
+        so they are discarded without searching.
+        """
+        message_ids = [
+            message_id for message_id in message_ids if "-openerp-" in message_id
+        ]
+        if not message_ids:
+            return self.browse()
+        return self.search([("message_id", "in", message_ids)])
+
     def _get_mail_tracking_token(self):
-        return tools.hmac(self.env(su=True), "automation_oca", self.id)
+        return self._get_tracking_token(self.id)
+
+    @api.model
+    @tools.ormcache()
+    def _get_tracking_secret(self):
+        return self.env["ir.config_parameter"].sudo().get_param("database.secret")
+
+    @api.model
+    def _get_tracking_token(self, record_id):
+        """Same result as tools.hmac, but the secret is cached"""
+        return hmac.new(
+            self._get_tracking_secret().encode(),
+            repr(("automation_oca", record_id)).encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+    @api.model
+    def _check_tracking_token(self, record_id, token):
+        return tools.consteq(token, self._get_tracking_token(record_id))
 
     def _get_mail_tracking_url(self):
         return werkzeug.urls.url_join(
@@ -271,14 +659,10 @@ class AutomationRecordStep(models.Model):
 
     def _cron_automation_steps(self):
         childs = self.browse()
-        for activity in self.search(
-            [
-                ("state", "=", "scheduled"),
-                ("scheduled_date", "<=", fields.Datetime.now()),
-            ]
-        ):
+        for activity in self._get_steps_to_run():
             childs |= activity.run(trigger_activity=False)
         childs._trigger_activities()
+        self._create_deferred_trigger()
         self.search(
             [
                 ("state", "=", "scheduled"),
@@ -287,12 +671,91 @@ class AutomationRecordStep(models.Model):
             ]
         )._expiry()
 
+    @api.model
+    def _get_steps_to_run(self):
+        """
+        Returns the scheduled steps that must be executed now.
+        Configurations with a step limit only provide the steps allowed by their
+        limit, the rest will wait for a new execution of the cron.
+        Mail steps are deferred while the email queue is full.
+        """
+        now = fields.Datetime.now()
+        domain = [("state", "=", "scheduled"), ("scheduled_date", "<=", now)]
+        if self._is_mail_queue_full():
+            self.search(
+                expression.AND(
+                    [
+                        domain,
+                        [("step_type", "=", "mail"), ("backpressure_date", "=", False)],
+                    ]
+                )
+            ).write({"backpressure_date": now})
+            domain = expression.AND([domain, [("step_type", "!=", "mail")]])
+            self._create_backpressure_trigger()
+        limited_configurations = (
+            self.env["automation.configuration"]
+            .with_context(active_test=False)
+            .search([("step_limit", ">", 0)])
+        )
+        steps = self.search(
+            expression.AND(
+                [domain, [("configuration_id", "not in", limited_configurations.ids)]]
+            )
+        )
+        throttled = False
+        for configuration in limited_configurations:
+            budget = configuration._get_step_limit_budget()
+            configuration_steps = self.search(
+                expression.AND([domain, [("configuration_id", "=", configuration.id)]]),
+                limit=budget + 1,
+            )
+            if len(configuration_steps) > budget:
+                throttled = True
+            steps |= configuration_steps[:budget]
+        if throttled:
+            self.env["ir.cron.trigger"].create(
+                {
+                    "call_at": now + relativedelta(minutes=1),
+                    "cron_id": self.env.ref("automation_oca.cron_step_execute").id,
+                }
+            )
+        return steps.sorted("scheduled_date")
+
+    @api.model
+    def _is_mail_queue_full(self):
+        threshold = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("automation_oca.mail_queue_threshold", 0)
+        )
+        if not threshold:
+            return False
+        return (
+            self.env["mail.mail"]
+            .sudo()
+            .search_count([("state", "=", "outgoing")], limit=threshold)
+            >= threshold
+        )
+
     def _trigger_activities(self):
         # Creates a cron trigger.
         # On glue modules we could use queue job for a more discrete example
         # But cron trigger fulfills the job in some way
-        for activity in self.filtered(lambda r: r.do_not_wait):
+        to_run = self.filtered(lambda r: r.do_not_wait)
+        # Steps of configurations with a step limit are left to the cron,
+        # that only executes the steps allowed by the limit
+        limited = to_run.filtered(lambda r: r.configuration_id.step_limit)
+        for activity in to_run - limited:
             activity.run()
+        if (to_run - limited).filtered("rate_limit_reserved"):
+            self._create_deferred_trigger()
+        if limited:
+            self.env["ir.cron.trigger"].create(
+                {
+                    "call_at": fields.Datetime.now(),
+                    "cron_id": self.env.ref("automation_oca.cron_step_execute").id,
+                }
+            )
         for date in set(
             self.filtered(lambda r: not r.do_not_wait).mapped("scheduled_date")
         ):
@@ -315,94 +778,156 @@ class AutomationRecordStep(models.Model):
     def _activate(self):
         todo = self.filtered(lambda r: not r.scheduled_date)
         current_date = fields.Datetime.now()
-        for record in todo:
-            config = record.configuration_step_id
-            scheduled_date = config._get_record_activity_scheduled_date(
-                record.record_id.resource_ref, force=True
+        for config, steps in todo.grouped("configuration_step_id").items():
+            if config._is_scheduled_date_record_independent():
+                scheduled_date = config._get_record_activity_scheduled_date(
+                    self.env[config.model], force=True
+                )
+                steps_by_date = {scheduled_date: steps}
+            else:
+                steps_by_date = defaultdict(lambda: self.browse())
+                for step in steps:
+                    scheduled_date = config._get_record_activity_scheduled_date(
+                        step.record_id.resource_ref, force=True
+                    )
+                    steps_by_date[scheduled_date] |= step
+            for scheduled_date, date_steps in steps_by_date.items():
+                date_steps.write(
+                    {
+                        "scheduled_date": scheduled_date,
+                        "do_not_wait": scheduled_date < current_date,
+                    }
+                )
+        todo._trigger_activities()
+
+    def _write_tracking_values(self, values, condition=None):
+        """
+        Write the values on the steps with a single query.
+        If a condition is passed, only the steps that fulfill it are updated.
+        """
+        if not self:
+            return
+        self.flush_recordset(list(values))
+        self.env.cr.execute(
+            SQL(
+                """
+                UPDATE automation_record_step
+                SET %(values)s, write_uid = %(uid)s, write_date = %(now)s
+                WHERE id = ANY(%(ids)s) AND %(condition)s
+                """,
+                values=SQL(", ").join(
+                    SQL("%s = %s", SQL.identifier(field), value)
+                    for field, value in values.items()
+                ),
+                uid=self.env.uid,
+                now=fields.Datetime.now(),
+                ids=self.ids,
+                condition=condition or SQL("TRUE"),
             )
-            record.write(
-                {
-                    "scheduled_date": scheduled_date,
-                    "do_not_wait": scheduled_date < current_date,
-                }
+        )
+        self.invalidate_recordset([*values, "write_uid", "write_date"])
+        self.modified(list(values))
+
+    def _get_childs_to_trigger(self, trigger_types):
+        """Children waiting for one of the trigger types"""
+        if not self:
+            return self.browse()
+        self.flush_model(["parent_id", "trigger_type", "scheduled_date", "state"])
+        self.env.cr.execute(
+            SQL(
+                """
+                SELECT id
+                FROM automation_record_step
+                WHERE parent_id = ANY(%(ids)s)
+                    AND trigger_type = ANY(%(trigger_types)s)
+                    AND scheduled_date IS NULL
+                    AND state = 'scheduled'
+                ORDER BY id
+                """,
+                ids=self.ids,
+                trigger_types=trigger_types,
             )
-        todo._trigger_activities()
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
 
     def _set_activity_done(self):
-        domain = safe_eval(
-            self.configuration_step_id.activity_verification_domain or "[]",
-            self.configuration_step_id.configuration_id._get_eval_context(),
-        )
-        if domain and not self.record_id.resource_ref.filtered_domain(domain):
-            raise ValidationError(
-                _(
-                    "The record does not fulfill the expected domain:\n%(domain)s",
-                    domain=self.configuration_step_id.activity_verification_domain_error,
-                )
+        for record in self:
+            config = record.configuration_step_id
+            domain = safe_eval(
+                config.activity_verification_domain or "[]",
+                config.configuration_id._get_eval_context(),
             )
-        self.write({"activity_done_on": fields.Datetime.now()})
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "activity_done"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._activate()
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "activity_cancel"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._reject()
+            if domain and not record.record_id.resource_ref.filtered_domain(domain):
+                raise ValidationError(
+                    _(
+                        "The record does not fulfill the expected domain:\n%(domain)s",
+                        domain=config.activity_verification_domain_error,
+                    )
+                )
+        self._write_tracking_values({"activity_done_on": fields.Datetime.now()})
+        self._get_childs_to_trigger(["activity_done"])._activate()
+        self._get_childs_to_trigger(["activity_cancel"])._reject()
 
     def _set_activity_cancel(self):
-        self.write({"activity_cancel_on": fields.Datetime.now()})
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "activity_cancel"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._activate()
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "activity_done"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._reject()
+        self._write_tracking_values({"activity_cancel_on": fields.Datetime.now()})
+        self._get_childs_to_trigger(["activity_cancel"])._activate()
+        self._get_childs_to_trigger(["activity_done"])._reject()
 
     def _set_mail_bounced(self):
-        self.write({"mail_status": "bounce"})
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "mail_bounce"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._activate()
+        self._write_tracking_values({"mail_status": "bounce"})
+        self._get_childs_to_trigger(["mail_bounce"])._activate()
 
-    def _set_mail_open(self):
-        self.filtered(lambda t: t.mail_status not in ["open", "reply"]).write(
-            {"mail_status": "open", "mail_opened_on": fields.Datetime.now()}
+    def _get_event_date_value(self, event_dates=None):
+        """
+        SQL value of the date of the events of the steps.
+        event_dates maps the ids of the steps to the date of their event, the
+        current date is used for the missing ones.
+        """
+        now = fields.Datetime.now()
+        if not event_dates:
+            return now
+        return SQL(
+            """
+            COALESCE((
+                SELECT data.event_date
+                FROM unnest(%s::int[], %s::timestamp[])
+                    AS data(record_step_id, event_date)
+                WHERE data.record_step_id = automation_record_step.id
+            ), %s)
+            """,
+            list(event_dates),
+            list(event_dates.values()),
+            now,
         )
-        self.child_ids.filtered(
-            lambda r: r.trigger_type
-            in ["mail_open", "mail_not_reply", "mail_not_clicked"]
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._activate()
 
-    def _set_mail_clicked(self):
-        self.filtered(lambda t: not t.mail_clicked_on).write(
-            {"mail_clicked_on": fields.Datetime.now()}
+    def _set_mail_open(self, event_dates=None):
+        self._write_tracking_values(
+            {
+                "mail_status": "open",
+                "mail_opened_on": self._get_event_date_value(event_dates),
+            },
+            SQL("mail_status IS NULL OR mail_status NOT IN ('open', 'reply')"),
         )
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "mail_click"
-            and not r.scheduled_date
-            and r.state == "scheduled"
+        self._get_childs_to_trigger(
+            ["mail_open", "mail_not_reply", "mail_not_clicked"]
         )._activate()
 
-    def _set_mail_reply(self):
-        self.filtered(lambda t: t.mail_status != "reply").write(
-            {"mail_status": "reply", "mail_replied_on": fields.Datetime.now()}
+    def _set_mail_clicked(self, event_dates=None):
+        self._write_tracking_values(
+            {"mail_clicked_on": self._get_event_date_value(event_dates)},
+            SQL("mail_clicked_on IS NULL"),
         )
-        self.child_ids.filtered(
-            lambda r: r.trigger_type == "mail_reply"
-            and not r.scheduled_date
-            and r.state == "scheduled"
-        )._activate()
+        self._get_childs_to_trigger(["mail_click"])._activate()
+
+    def _set_mail_reply(self, event_dates=None):
+        self._write_tracking_values(
+            {
+                "mail_status": "reply",
+                "mail_replied_on": self._get_event_date_value(event_dates),
+            },
+            SQL("mail_status IS DISTINCT FROM 'reply'"),
+        )
+        self._get_childs_to_trigger(["mail_reply"])._activate()
 
     @api.depends("state")
     def _compute_step_actions(self):
@@ -431,7 +956,7 @@ class AutomationRecordStep(models.Model):
                 {
                     "icon": "fa fa-envelope",
                     "name": _("Sent"),
-                    "done": bool(self.mail_status and self.mail_status != "bounced"),
+                    "done": self.mail_status not in [False, "queue", "bounce"],
                     "color": "text-success",
                 },
                 {
@@ -467,7 +992,9 @@ class AutomationRecordStep(models.Model):
         """
         Retry the record step
         """
-        if self.state not in ["error", "rejected", "expired", "cancel"]:
+        if self.filtered(
+            lambda r: r.state not in ["error", "rejected", "expired", "cancel"]
+        ):
             raise ValidationError(
                 _(
                     "You can only retry a record step in a rejected, "
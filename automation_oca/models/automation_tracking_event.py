@@ -0,0 +1,195 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from odoo import api, fields, models
+from odoo.tools.sql import SQL
+
+
+def _set_first_date(dates, key, date):
+    """Keep the earliest date of the key, None being an unknown date"""
+    if key not in dates or (date and (not dates[key] or date < dates[key])):
+        dates[key] = date
+
+
+class AutomationTrackingEvent(models.Model):
+    """
+    Tracking events (opens, clicks and replies) are stored here and applied to
+    the record steps later by a cron. This way, tracking requests never wait for
+    the locks of the steps that are being processed.
+    """
+
+    _name = "automation.tracking.event"
+    _description = "Automation Tracking Event"
+    _log_access = False
+    _order = "id"
+
+    record_step_id = fields.Many2one(
+        "automation.record.step", required=True, ondelete="cascade"
+    )
+    event_type = fields.Selection(
+        [
+            ("open", "Opened"),
+            ("click", "Clicked"),
+            ("reply", "Replied"),
+            ("bounce", "Bounced"),
+        ],
+        required=True,
+    )
+    event_date = fields.Datetime(required=True)
+
+    @api.model
+    def _add_events(self, record_step_ids, event_type, event_dates=None):
+        """
+        Insert the events of the existing steps without using the ORM.
+        event_dates maps the ids of the steps to the date of their event,
+        the current date is used for the missing ones.
+        Returns the number of inserted events.
+        """
+        if not record_step_ids:
+            return 0
+        event_dates = event_dates or {}
+        self.env.cr.execute(
+            SQL(
+                """
+                INSERT INTO automation_tracking_event (
+                    record_step_id, event_type, event_date
+                )
+                SELECT step.id, %(event_type)s, COALESCE(data.event_date, %(now)s)
+                FROM automation_record_step step
+                LEFT JOIN unnest(%(dated_ids)s::int[], %(dates)s::timestamp[])
+                    AS data(record_step_id, event_date)
+                    ON data.record_step_id = step.id
+                WHERE step.id = ANY(%(ids)s)
+                """,
+                event_type=event_type,
+                now=fields.Datetime.now(),
+                dated_ids=list(event_dates),
+                dates=list(event_dates.values()),
+                ids=list(record_step_ids),
+            )
+        )
+        return self.env.cr.rowcount
+
+    @api.model
+    def _get_external_event_date(self, event):
+        """
+        Date of an external event, from its `timestamp` as seconds since the
+        epoch or as an ISO 8601 string.
+        Missing, wrong and future dates return None.
+        """
+        timestamp = event.get("timestamp")
+        try:
+            if isinstance(timestamp, int | float) and not isinstance(timestamp, bool):
+                date = datetime.fromtimestamp(timestamp, timezone.utc)
+            elif isinstance(timestamp, str):
+                date = datetime.fromisoformat(timestamp)
+            else:
+                return None
+        except (ValueError, OverflowError, OSError):
+            return None
+        if date.tzinfo:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+        if date > fields.Datetime.now():
+            return None
+        return date
+
+    @api.model
+    def _add_external_events(self, events):
+        """
+        Register the events received from an external provider.
+        Each event is a dictionary with the kind of event (`event`), the
+        `message_id` of the email or the `step_id` of the record step and
+        optionally the `timestamp` of the event.
+        """
+        event_types = dict(self._fields["event_type"].selection)
+        step_dates = defaultdict(dict)
+        message_dates = defaultdict(dict)
+        for event in events:
+            if not isinstance(event, dict) or event.get("event") not in event_types:
+                continue
+            if isinstance(event.get("step_id"), int):
+                dates, key = step_dates[event["event"]], event["step_id"]
+            elif isinstance(event.get("message_id"), str):
+                dates, key = message_dates[event["event"]], event["message_id"]
+            else:
+                continue
+            _set_first_date(dates, key, self._get_external_event_date(event))
+        all_message_ids = set().union(*message_dates.values())
+        steps_by_message_id = defaultdict(set)
+        if all_message_ids:
+            self.env.cr.execute(
+                SQL(
+                    """
+                    SELECT message_id, id
+                    FROM automation_record_step
+                    WHERE message_id = ANY(%(message_ids)s)
+                    """,
+                    message_ids=list(all_message_ids),
+                )
+            )
+            for message_id, record_step_id in self.env.cr.fetchall():
+                steps_by_message_id[message_id].add(record_step_id)
+        accepted = 0
+        for event_type in event_types:
+            dates = dict(step_dates[event_type])
+            for message_id, date in message_dates[event_type].items():
+                for record_step_id in steps_by_message_id[message_id]:
+                    _set_first_date(dates, record_step_id, date)
+            accepted += self._add_events(
+                dates,
+                event_type,
+                {step_id: date for step_id, date in dates.items() if date},
+            )
+        if accepted:
+            self.env.ref("automation_oca.cron_tracking_event_process")._trigger()
+        return {"received": len(events), "accepted": accepted}
+
+    @api.model
+    def _cron_process_events(self, limit=10000):
+        """
+        Apply the pending events to the steps. Events are deduplicated by step,
+        so each step is updated only once for each kind of event, with the date
+        of its first event.
+        """
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH deleted AS (
+                    DELETE FROM automation_tracking_event
+                    WHERE id IN (
+                        SELECT id FROM automation_tracking_event
+                        ORDER BY id
+                        LIMIT %(limit)s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING record_step_id, event_type, event_date
+                )
+                SELECT event_type, record_step_id, MIN(event_date), COUNT(*)
+                FROM deleted
+                GROUP BY event_type, record_step_id
+                """,
+                limit=limit,
+            )
+        )
+        event_dates = defaultdict(dict)
+        processed = 0
+        for event_type, record_step_id, event_date, count in self.env.cr.fetchall():
+            event_dates[event_type][record_step_id] = event_date
+            processed += count
+        # Clicks and replies imply that the email has been opened
+        open_dates = {}
+        for event_type in ["open", "click", "reply"]:
+            for record_step_id, event_date in event_dates[event_type].items():
+                _set_first_date(open_dates, record_step_id, event_date)
+        steps = self.env["automation.record.step"]
+        steps.browse(sorted(open_dates))._set_mail_open(open_dates)
+        click_dates = event_dates["click"]
+        steps.browse(sorted(click_dates))._set_mail_clicked(click_dates)
+        reply_dates = event_dates["reply"]
+        steps.browse(sorted(reply_dates))._set_mail_reply(reply_dates)
+        steps.browse(sorted(event_dates["bounce"]))._set_mail_bounced()
+        if processed == limit:
+            self.env.ref("automation_oca.cron_tracking_event_process")._trigger()
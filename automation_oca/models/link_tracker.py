@@ -1,7 +1,101 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from collections import Counter
+
 from odoo import api, fields, models
+from odoo.tools.lru import LRU
+from odoo.tools.sql import SQL
+
+from ..utils.cache import get_worker_cache, pop_worker_cache, set_worker_cache
+from .mail_render_mixin import SHORTENED_BODIES
+
+# Links and redirection urls of the codes, by database and code
+LINKS = LRU(4096)
+
+
+def _clear_links(tracker_codes):
+    """Remove the codes from the cache of the links"""
+    for tracker_code in tracker_codes:
+        pop_worker_cache(
+            tracker_codes.env.cr,
+            LINKS,
+            (tracker_codes.env.cr.dbname, tracker_code.code),
+        )
+
+
+class LinkTracker(models.Model):
+    _inherit = "link.tracker"
+
+    @api.model
+    def _get_automation_link(self, code):
+        """
+        Returns the link of a code and the url where it redirects,
+        or (False, False) if the code doesn't exist
+        """
+        key = (self.env.cr.dbname, code)
+        link = get_worker_cache(self.env.cr, LINKS, key)
+        if link is None:
+            tracker = (
+                self.env["link.tracker.code"]
+                .sudo()
+                .search([("code", "=", code)], limit=1)
+                .link_id
+            )
+            link = (tracker.id, tracker.redirected_url)
+            # Unknown codes are not cached, as they might be created later
+            if tracker:
+                set_worker_cache(self.env.cr, LINKS, key, link)
+        return link
+
+    @api.model
+    def search_or_create(self, vals_list):
+        """
+        When shortening the links of automation emails, the trackers are kept
+        until the end of the transaction, as all the emails of a step usually
+        share the same links.
+        """
+        if not self.env.context.get("automation_link_tracker_cache"):
+            return super().search_or_create(vals_list)
+        trackers = self.env.cr.precommit.data.setdefault(
+            "automation_oca.link_trackers", {}
+        )
+        link_ids = []
+        for vals in vals_list:
+            key = tuple(sorted(vals.items()))
+            if key not in trackers:
+                trackers[key] = super().search_or_create([vals]).id
+            link_ids.append(trackers[key])
+        return self.browse(link_ids)
+
+    def write(self, vals):
+        # The redirection url depends on several fields of the tracker
+        _clear_links(self.code_ids)
+        return super().write(vals)
+
+    def unlink(self):
+        _clear_links(self.code_ids)
+        result = super().unlink()
+        self.env.cr.precommit.data.pop("automation_oca.link_trackers", None)
+        # Shortened bodies might refer to the removed codes
+        SHORTENED_BODIES.clear()
+        return result
+
+
+class LinkTrackerCode(models.Model):
+    _inherit = "link.tracker.code"
+
+    def write(self, vals):
+        if "code" in vals or "link_id" in vals:
+            _clear_links(self)
+        return super().write(vals)
+
+    def unlink(self):
+        _clear_links(self)
+        result = super().unlink()
+        # Shortened bodies might refer to the removed codes
+        SHORTENED_BODIES.clear()
+        return result
 
 
 class LinkTrackerClick(models.Model):
@@ -15,31 +109,127 @@ class LinkTrackerClick(models.Model):
         related="automation_record_step_id.configuration_id", store=True
     )
 
+    def init(self):
+        super().init()
+        # Only one click is registered by step, link and IP
+        self.env.cr.execute(
+            SQL(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS
+                    link_tracker_click_automation_record_step_unique
+                ON link_tracker_click (
+                    automation_record_step_id, link_id, COALESCE(ip, '')
+                )
+                WHERE automation_record_step_id IS NOT NULL
+                """
+            )
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        counter = self.env["automation.configuration.counter"]
+        counter._add_counts(counter._get_counts(records))
+        return records
+
+    def _write(self, vals):
+        if "automation_configuration_id" not in vals:
+            return super()._write(vals)
+        counter = self.env["automation.configuration.counter"]
+        previous_counts = counter._get_counts(self)
+        result = super()._write(vals)
+        counts = Counter(counter._get_counts(self))
+        counts.subtract(previous_counts)
+        counter._add_counts(counts)
+        return result
+
+    def unlink(self):
+        self.flush_recordset()
+        counter = self.env["automation.configuration.counter"]
+        counts = Counter()
+        counts.subtract(counter._get_counts(self))
+        counter._add_counts(counts)
+        return super().unlink()
+
+    @api.model
+    def _get_counter_query(self, condition=None):
+        """Query of the counters of the clicks by configuration"""
+        return SQL(
+            """
+            SELECT automation_configuration_id, 'click', COUNT(*)
+            FROM link_tracker_click
+            WHERE automation_configuration_id IS NOT NULL AND %s
+            GROUP BY automation_configuration_id
+            """,
+            condition or SQL("TRUE"),
+        )
+
     @api.model
     def add_click(self, code, automation_record_step_id=False, **route_values):
         if automation_record_step_id:
-            tracker_code = self.env["link.tracker.code"].search([("code", "=", code)])
-            if not tracker_code:
-                return None
-            ip = route_values.get("ip", False)
-            if self.search_count(
-                [
-                    (
-                        "automation_record_step_id",
-                        "=",
-                        automation_record_step_id,
-                    ),
-                    ("link_id", "=", tracker_code.link_id.id),
-                    ("ip", "=", ip),
-                ]
-            ):
+            link_id = self.env["link.tracker"]._get_automation_link(code)[0]
+            if not link_id:
                 return None
-            route_values["link_id"] = tracker_code.link_id.id
+            route_values["link_id"] = link_id
             click_values = self._prepare_click_values_from_route(
                 automation_record_step_id=automation_record_step_id, **route_values
             )
-            click = self.create(click_values)
-            click.automation_record_step_id._set_mail_open()
-            click.automation_record_step_id._set_mail_clicked()
-            return click
+            return self._add_automation_click(click_values)
         return super().add_click(code, **route_values)
+
+    @api.model
+    def _add_automation_click(self, click_values):
+        """
+        Register the click and its tracking event in a single query.
+        Duplicated clicks are ignored thanks to the unique index.
+        """
+        now = fields.Datetime.now()
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH click AS (
+                    INSERT INTO link_tracker_click (
+                        link_id, campaign_id, ip, country_id,
+                        automation_record_step_id, automation_configuration_step_id,
+                        automation_configuration_id,
+                        create_uid, create_date, write_uid, write_date
+                    )
+                    SELECT
+                        link.id, link.campaign_id, %(ip)s, %(country_id)s,
+                        step.id, step.configuration_step_id, step.configuration_id,
+                        %(uid)s, %(now)s, %(uid)s, %(now)s
+                    FROM link_tracker link, automation_record_step step
+                    WHERE link.id = %(link_id)s
+                        AND step.id = %(automation_record_step_id)s
+                    ON CONFLICT (
+                        automation_record_step_id, link_id, COALESCE(ip, '')
+                    )
+                    WHERE automation_record_step_id IS NOT NULL
+                    DO NOTHING
+                    RETURNING
+                        id, automation_record_step_id, automation_configuration_id
+                ), event AS (
+                    INSERT INTO automation_tracking_event (
+                        record_step_id, event_type, event_date
+                    )
+                    SELECT automation_record_step_id, 'click', %(now)s FROM click
+                )
+                SELECT id, automation_configuration_id FROM click
+                """,
+                link_id=click_values["link_id"],
+                automation_record_step_id=click_values["automation_record_step_id"],
+                ip=click_values.get("ip") or None,
+                country_id=click_values.get("country_id") or None,
+                uid=self.env.uid,
+                now=now,
+            )
+        )
+        rows = self.env.cr.fetchall()
+        clicks = self.browse([row[0] for row in rows])
+        self.env["automation.configuration.counter"]._add_counts(
+            Counter((row[1], "click") for row in rows if row[1])
+        )
+        # Stored fields depending on the clicks (like the count of the link)
+        # must be recomputed as if the clicks were created by the ORM
+        clicks.modified(["link_id", "automation_record_step_id"], create=True)
+        return clicks
@@ -1,11 +1,10 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-import re
-
-import werkzeug.urls
-
 from odoo import api, fields, models, tools
+from odoo.tools.sql import SQL
+
+from ..utils.links import add_shortened_link_suffix
 
 
 class MailMail(models.Model):
@@ -16,10 +15,45 @@ class MailMail(models.Model):
     @api.model_create_multi
     def create(self, values_list):
         records = super().create(values_list)
-        for record in records.filtered("automation_record_step_id"):
-            record.automation_record_step_id.message_id = record.message_id
+        records._set_automation_message_ids()
         return records
 
+    def _set_automation_message_ids(self):
+        """Copy the message id of the emails to their steps with a single query"""
+        mails = self.filtered("automation_record_step_id")
+        if not mails:
+            return
+        steps = mails.automation_record_step_id
+        steps.flush_recordset(["message_id"])
+        self.env.cr.execute(
+            SQL(
+                """
+                UPDATE automation_record_step step
+                SET message_id = data.message_id
+                FROM unnest(%(step_ids)s, %(message_ids)s)
+                    AS data(record_step_id, message_id)
+                WHERE step.id = data.record_step_id
+                """,
+                step_ids=[mail.automation_record_step_id.id for mail in mails],
+                message_ids=[mail.message_id for mail in mails],
+            )
+        )
+        steps.invalidate_recordset(["message_id"])
+
+    def _postprocess_sent_message(self, success_pids, *args, **kwargs):
+        """
+        Queued steps are marked as sent once the email has been delivered, and
+        as bounced if it failed or it was cancelled
+        """
+        queued = self.filtered(
+            lambda r: r.automation_record_step_id.mail_status == "queue"
+        )
+        sent = queued.filtered(lambda r: r.state == "sent")
+        sent.automation_record_step_id.write({"mail_status": "sent"})
+        failed = queued.filtered(lambda r: r.state in ("exception", "cancel"))
+        failed.automation_record_step_id._set_mail_bounced()
+        return super()._postprocess_sent_message(success_pids, *args, **kwargs)
+
     def _prepare_outgoing_body(self):
         """Override to add the tracking URL to the body and to add trace ID in
         shortened urls"""
@@ -27,21 +61,14 @@ class MailMail(models.Model):
         # super() already cleans pseudo-void content from editor
         body = super()._prepare_outgoing_body()
         if body and self.automation_record_step_id:
-            body = self.env["mail.render.mixin"]._shorten_links(body, {})
+            # Links were shortened on the template before rendering it
             Wrapper = body.__class__
             token = self.automation_record_step_id._get_mail_tracking_token()
-            for match in set(re.findall(tools.mail.URL_REGEX, body)):
-                href = match[0]
-                url = match[1]
-
-                parsed = werkzeug.urls.url_parse(url, scheme="http")
-
-                if parsed.scheme.startswith("http") and parsed.path.startswith("/r/"):
-                    new_href = href.replace(
-                        url,
-                        f"{url}/au/{str(self.automation_record_step_id.id)}/{token}",
-                    )
-                    body = body.replace(Wrapper(href), Wrapper(new_href))
+            body = Wrapper(
+                add_shortened_link_suffix(
+                    body, f"/au/{self.automation_record_step_id.id}/{token}"
+                )
+            )
 
             # generate tracking URL
             tracking_url = self.automation_record_step_id._get_mail_tracking_url()
@@ -0,0 +1,61 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, models
+from odoo.tools.lru import LRU
+
+from ..utils.cache import get_worker_cache, set_worker_cache
+
+# Bodies of the templates with their links shortened, by database and body
+SHORTENED_BODIES = LRU(64)
+
+
+class MailRenderMixin(models.AbstractModel):
+    _inherit = "mail.render.mixin"
+
+    @api.model
+    def _render_template(
+        self,
+        template_src,
+        model,
+        res_ids,
+        engine="inline_template",
+        add_context=None,
+        options=None,
+    ):
+        """
+        The links of the body of the automation emails are shortened on the
+        template, before rendering it for each recipient
+        """
+        if (
+            engine == "qweb"
+            and template_src
+            and self.env.context.get("automation_shorten_links")
+        ):
+            template_src = self._get_automation_shortened_body(template_src)
+        return super()._render_template(
+            template_src,
+            model,
+            res_ids,
+            engine=engine,
+            add_context=add_context,
+            options=options,
+        )
+
+    @api.model
+    def _get_automation_shortened_body(self, body):
+        """
+        Body with its links shortened. The bodies shortened in a transaction
+        are shared with the other ones only once it is committed, as they may
+        refer to trackers created in it.
+        """
+        key = (self.env.cr.dbname, str(body))
+        shortened = get_worker_cache(self.env.cr, SHORTENED_BODIES, key)
+        if shortened is None:
+            shortened = body.__class__(
+                self.with_context(automation_link_tracker_cache=True)._shorten_links(
+                    body, {}
+                )
+            )
+            set_worker_cache(self.env.cr, SHORTENED_BODIES, key, shortened)
+        return shortened
@@ -13,8 +13,8 @@ class MailThread(models.AbstractModel):
         result = super()._routing_handle_bounce(email_message, message_dict)
         bounced_msg_ids = message_dict["bounced_msg_ids"]
         if bounced_msg_ids:
-            self.env["automation.record.step"].search(
-                [("message_id", "in", bounced_msg_ids)]
+            self.env["automation.record.step"]._search_message_ids(
+                bounced_msg_ids
             )._set_mail_bounced()
         return result
 
@@ -29,11 +29,12 @@ class MailThread(models.AbstractModel):
             )
             msg_references = tools.mail.mail_header_msgid_re.findall(thread_references)
             if msg_references:
-                records = self.env["automation.record.step"].search(
-                    [("message_id", "in", msg_references)]
+                records = self.env["automation.record.step"]._search_message_ids(
+                    msg_references
+                )
+                self.env["automation.tracking.event"].sudo()._add_events(
+                    records.ids, "reply"
                 )
-                records._set_mail_open()
-                records._set_mail_reply()
         return super()._message_route_process(message, message_dict, routes)
 
     @api.model
@@ -1,6 +1,8 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from unittest.mock import patch
+
 from .common import AutomationTestCase
 
 
@@ -45,6 +47,130 @@ class TestAutomationAction(AutomationTestCase):
         self.assertFalse(record_activity.step_actions)
         self.assertTrue(self.partner_01.comment)
 
+    def test_step_limit(self):
+        """
+        Steps over the limit of the configuration wait for the next execution
+        """
+        activity = self.create_server_action()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.step_limit = 1
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual(2, len(record_activities))
+        cron = self.env.ref("automation_oca.cron_step_execute")
+        triggers = self.env["ir.cron.trigger"].search([("cron_id", "=", cron.id)])
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(
+            ["done", "scheduled"], sorted(record_activities.mapped("state"))
+        )
+        self.assertTrue(
+            self.env["ir.cron.trigger"].search(
+                [("cron_id", "=", cron.id), ("id", "not in", triggers.ids)]
+            )
+        )
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(["done", "done"], record_activities.mapped("state"))
+
+    def test_step_limit_immediate(self):
+        """
+        Steps that don't wait are executed by the cron when the configuration
+        has a step limit
+        """
+        activity = self.create_server_action(trigger_interval=-1)
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.step_limit = 1
+        self.configuration.start_automation()
+        cron = self.env.ref("automation_oca.cron_step_execute")
+        triggers = self.env["ir.cron.trigger"].search([("cron_id", "=", cron.id)])
+        self.env["automation.configuration"].cron_automation()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual(["scheduled", "scheduled"], record_activities.mapped("state"))
+        self.assertTrue(
+            self.env["ir.cron.trigger"].search(
+                [("cron_id", "=", cron.id), ("id", "not in", triggers.ids)]
+            )
+        )
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(
+            ["done", "scheduled"], sorted(record_activities.mapped("state"))
+        )
+
+    def test_step_limit_minute(self):
+        """
+        On minute limits, the steps executed during the last minute are discounted
+        """
+        activity = self.create_server_action()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.write({"step_limit": 1, "step_limit_period": "minute"})
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(
+            ["done", "scheduled"], sorted(record_activities.mapped("state"))
+        )
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(
+            ["done", "scheduled"], sorted(record_activities.mapped("state"))
+        )
+
+    def test_execution_duration(self):
+        """
+        We want to check that the execution time is stored and aggregated per step
+        """
+        activity = self.create_server_action()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual("done", record_activity.state)
+        self.assertTrue(record_activity.duration)
+        self.assertEqual(record_activity.duration, activity.duration_max)
+        self.assertEqual(record_activity.duration, activity.duration_avg)
+
+    def test_execution_timeout(self):
+        """
+        A step that exceeds its timeout is marked as error and its changes are
+        discarded
+        """
+        activity = self.create_server_action(execution_timeout=1)
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        step_class = type(self.env["automation.record.step"])
+        original_run_action = step_class._run_action
+
+        def _run_action(step):
+            result = original_run_action(step)
+            step.env.flush_all()
+            step.env.cr.execute("SELECT pg_sleep(2)")
+            return result
+
+        with patch.object(step_class, "_run_action", _run_action):
+            self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual("error", record_activity.state)
+        self.assertIn("timeout", record_activity.error_message)
+        self.assertEqual("Demo", self.partner_01.comment)
+
     def test_child_execution_filters(self):
         """
         We will create a task that executes two more tasks filtered with and extra task
@@ -2,6 +2,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 from datetime import datetime
+from unittest.mock import patch
 
 from freezegun import freeze_time
 
@@ -175,6 +176,34 @@ class TestAutomationBase(AutomationTestCase):
         self.env["automation.record.step"]._cron_automation_steps()
         self.assertEqual(record.state, "error")
         self.assertTrue(record.error_trace)
+        self.assertTrue(record.error_signature_id)
+        self.assertIn("ERROR", record.error_message)
+
+    def test_exception_signature(self):
+        """
+        Check that the same error on several records is stored only once
+        """
+        activity = self.create_server_action(server_action_id=self.error_action.id)
+        self.configuration.editable_domain = (
+            f"[('id', 'in', [{self.partner_01.id}, {self.partner_02.id}])]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        records = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual(2, len(records))
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual({"error"}, set(records.mapped("state")))
+        signature = records.error_signature_id
+        self.assertEqual(1, len(signature))
+        self.assertEqual(2, signature.count)
+        self.assertEqual(2, signature.record_step_error_count)
+        self.assertTrue(signature.error_trace)
+        signature.retry()
+        self.assertEqual({"scheduled"}, set(records.mapped("state")))
+        signature.invalidate_recordset()
+        self.assertEqual(0, signature.record_step_error_count)
 
     def test_record_resource_information(self):
         """
@@ -270,6 +299,197 @@ class TestAutomationBase(AutomationTestCase):
         self.assertEqual(1, self.configuration.record_count)
         self.assertEqual(0, self.configuration.record_test_count)
 
+    def test_counter_maintenance(self):
+        """
+        Counters are updated with the state of the records and steps, and they
+        keep their values when they are compacted or rebuilt
+        """
+        self.create_server_action()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.configuration.invalidate_recordset()
+        self.assertEqual(1, self.configuration.record_run_count)
+        self.assertEqual(0, self.configuration.record_done_count)
+        self.assertEqual(0, self.configuration.activity_action_count)
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.configuration.invalidate_recordset()
+        self.assertEqual(0, self.configuration.record_run_count)
+        self.assertEqual(1, self.configuration.record_done_count)
+        self.assertEqual(1, self.configuration.activity_action_count)
+        counter = self.env["automation.configuration.counter"]
+        domain = [("configuration_id", "=", self.configuration.id)]
+        counter._cron_compact()
+        self.assertEqual(
+            ["activity_action", "record", "record_done"],
+            sorted(counter.search(domain).mapped("counter")),
+        )
+        counter.search(domain).unlink()
+        counter._cron_rebuild()
+        self.configuration.invalidate_recordset()
+        self.assertEqual(1, self.configuration.record_count)
+        self.assertEqual(1, self.configuration.record_done_count)
+        self.assertEqual(1, self.configuration.activity_action_count)
+        self.env["automation.record"].search(domain).unlink()
+        self.configuration.invalidate_recordset()
+        self.assertEqual(0, self.configuration.record_count)
+        self.assertEqual(0, self.configuration.activity_action_count)
+
+    def test_counter_compact_threshold(self):
+        """
+        Compaction is triggered when a counter is read with too many deltas
+        """
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        cron = self.env.ref("automation_oca.cron_configuration_counter_compact")
+        trigger_domain = [("cron_id", "=", cron.id)]
+        self.env["ir.cron.trigger"].search(trigger_domain).unlink()
+        self.configuration.invalidate_recordset()
+        self.assertEqual(2, self.configuration.record_count)
+        self.assertFalse(self.env["ir.cron.trigger"].search(trigger_domain))
+        with patch(
+            "odoo.addons.automation_oca.models.automation_configuration_counter."
+            "COMPACT_THRESHOLD",
+            1,
+        ):
+            self.configuration.invalidate_recordset()
+            self.assertEqual(2, self.configuration.record_count)
+            self.configuration.invalidate_recordset()
+            self.assertEqual(2, self.configuration.record_count)
+        self.assertEqual(1, len(self.env["ir.cron.trigger"].search(trigger_domain)))
+
+    def test_approximate_count(self):
+        """
+        Counts of the lists are not computed when the planner estimates more
+        records than the threshold
+        """
+        self.create_server_action()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        domain = [("configuration_id", "=", self.configuration.id)]
+        for model in ["automation.record", "automation.record.step"]:
+            result = self.env[model].web_search_read(domain, {"id": {}}, limit=1)
+            self.assertEqual(2, result["length"])
+        self.env["ir.config_parameter"].sudo().set_param(
+            "automation_oca.approximate_count_threshold", 1
+        )
+        for model in ["automation.record", "automation.record.step"]:
+            # The web client shows the count as inexact when it is equal to the
+            # count limit it sent
+            result = self.env[model].web_search_read(
+                domain, {"id": {}}, limit=1, count_limit=100
+            )
+            self.assertEqual(100, result["length"])
+            self.assertEqual(1, len(result["records"]))
+            # Exact count requested
+            result = self.env[model].web_search_read(domain, {"id": {}}, limit=1)
+            self.assertEqual(2, result["length"])
+            # Last page is not full, so its length is exact
+            result = self.env[model].web_search_read(
+                domain, {"id": {}}, offset=1, limit=80, count_limit=100
+            )
+            self.assertEqual(2, result["length"])
+
+    @mute_logger("odoo.addons.automation_oca.models.automation_record")
+    def test_orphan_record_steps_cancelled(self):
+        """
+        Scheduled steps of the records whose document is deleted are cancelled
+        """
+        self.create_server_action()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        records = self.env["automation.record"].search(
+            [("configuration_id", "=", self.configuration.id)]
+        )
+        self.partner_01.unlink()
+        self.env["automation.record"]._cron_flag_orphan_records()
+        orphan = records.filtered("is_orphan_record")
+        self.assertEqual(1, len(orphan))
+        self.assertFalse(orphan.res_id)
+        self.assertEqual("cancel", orphan.automation_step_ids.state)
+        self.assertEqual("scheduled", (records - orphan).automation_step_ids.state)
+
+    def test_record_name(self):
+        """
+        Names of the documents are fetched once for all the records, and the
+        records can be searched by the name of their document
+        """
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        records = self.env["automation.record"].search(
+            [("configuration_id", "=", self.configuration.id)], order="res_id"
+        )
+        self.assertEqual(["Demo partner", "Demo partner 2"], records.mapped("name"))
+        query_counts = []
+        for batch in (records[:1], records):
+            self.env.invalidate_all()
+            query_count = self.env.cr.sql_log_count
+            batch.mapped("name")
+            query_counts.append(self.env.cr.sql_log_count - query_count)
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(
+            records[1],
+            self.env["automation.record"].search(
+                [
+                    ("configuration_id", "=", self.configuration.id),
+                    ("document_name", "ilike", "partner 2"),
+                ]
+            ),
+        )
+        # The name of the documents is shown even if it is empty
+        with patch.object(
+            type(records),
+            "_get_document_names",
+            return_value={records[0].res_id: ""},
+        ):
+            records.invalidate_recordset(["name"])
+            self.assertFalse(records[0].name)
+            self.assertEqual("Orphan Record", records[1].name)
+
+    @mute_logger("odoo.addons.automation_oca.models.automation_record")
+    def test_record_pending_step_count(self):
+        """
+        The state of the records follows the number of scheduled steps, and
+        wrong numbers are fixed by the repair routine
+        """
+        activity = self.create_server_action()
+        self.create_server_action(parent_id=activity.id)
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        record = self.env["automation.record"].search(
+            [("configuration_id", "=", self.configuration.id)]
+        )
+        self.assertEqual(1, record.pending_step_count)
+        self.assertEqual("run", record.state)
+        # The child step is created and executed on the same run
+        self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(2, len(record.automation_step_ids))
+        self.assertEqual(0, record.pending_step_count)
+        self.assertEqual("done", record.state)
+        record_model = self.env["automation.record"]
+        self.assertFalse(record_model._cron_repair_pending_step_count())
+        self.env.cr.execute(
+            "UPDATE automation_record SET pending_step_count = 3 WHERE id = %s",
+            (record.id,),
+        )
+        record.invalidate_recordset()
+        self.assertEqual(record, record_model._cron_repair_pending_step_count())
+        self.assertEqual(0, record.pending_step_count)
+        self.assertEqual("done", record.state)
+
     def test_start_configuration_twice_exception(self):
         """
         Check that we cannot start automation twice
@@ -379,6 +599,92 @@ class TestAutomationBase(AutomationTestCase):
         self.assertEqual(1, sum(d["y"] for d in child_activity.graph_data["done"]))
         self.assertEqual(0, sum(d["y"] for d in child_activity.graph_data["error"]))
 
+    def test_graph_stats(self):
+        """
+        Statistics are moved when a failed step is retried and when it is
+        removed, they can be rebuilt from the record steps and the deltas
+        are merged when compacted.
+        """
+        activity = self.create_server_action(server_action_id=self.error_action.id)
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        activity.invalidate_recordset()
+        self.assertEqual(1, activity.graph_error)
+        record_step = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        record_step.retry()
+        activity.invalidate_recordset()
+        self.assertEqual(0, activity.graph_error)
+        self.assertEqual(0, sum(d["y"] for d in activity.graph_data["error"]))
+        self.env["automation.record.step"]._cron_automation_steps()
+        activity.invalidate_recordset()
+        self.assertEqual(1, activity.graph_error)
+        self.env["automation.configuration.step.stat"]._rebuild()
+        activity.invalidate_recordset()
+        self.assertEqual(1, activity.graph_error)
+        record_step.unlink()
+        activity.invalidate_recordset()
+        self.assertEqual(0, activity.graph_error)
+        stat = self.env["automation.configuration.step.stat"]
+        self.assertTrue(stat.search([("configuration_step_id", "=", activity.id)]))
+        stat._cron_compact()
+        self.assertFalse(stat.search([("configuration_step_id", "=", activity.id)]))
+
+    def test_funnel_report(self):
+        """
+        The funnel report shows the processed steps once it is refreshed
+        """
+        activity = self.create_server_action()
+        error_activity = self.create_server_action(
+            server_action_id=self.error_action.id
+        )
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        report = self.env["automation.funnel.report"]
+        domain = [("configuration_id", "=", self.configuration.id)]
+        self.assertFalse(report.search(domain))
+        report._cron_refresh()
+        lines = report.search(domain)
+        self.assertEqual(2, len(lines))
+        line = lines.filtered(lambda r: r.configuration_step_id == activity)
+        self.assertEqual(1, line.processed_count)
+        self.assertEqual(1, line.done_count)
+        self.assertEqual(0, line.error_count)
+        line = lines.filtered(lambda r: r.configuration_step_id == error_activity)
+        self.assertEqual(1, line.processed_count)
+        self.assertEqual(0, line.done_count)
+        self.assertEqual(1, line.error_count)
+        # Updating the module keeps the view and its data
+        report.init()
+        report.invalidate_model()
+        self.assertEqual(2, report.search_count(domain))
+
+    def test_graph_query_count(self):
+        """
+        Totals of the steps are computed with the same number of queries
+        regardless of the number of steps
+        """
+        steps = self.create_server_action()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        small_batch = steps
+        for _i in range(10):
+            steps |= self.create_server_action()
+            steps |= self.create_server_action(server_action_id=self.error_action.id)
+        for batch in (small_batch, steps):
+            self.env.flush_all()
+            self.env.invalidate_all()
+            with self.assertQueryCount(1):
+                self.assertEqual(1, sum(batch.mapped("graph_done")))
+                self.assertEqual(0, sum(batch.mapped("graph_error")))
+
     def test_schedule_date_computation_hours(self):
         with freeze_time("2022-01-01"):
             activity = self.create_server_action(trigger_interval=1)
@@ -618,21 +924,19 @@ class TestAutomationBase(AutomationTestCase):
         self.configuration.start_automation()
         self.env["automation.configuration"].cron_automation()
         self.partner_01.unlink()
-        # We need two searches because in the first one, we access as a non-superuser to
-        # avoid the first return of the private method _search of automation.record and
-        # thus be able to access the part where orphaned records are filtered. The
-        # second search is to finally get the query we need, which is the one performed
-        # by accessing as a superuser.
+        self.env["automation.record"]._cron_flag_orphan_records()
+        # Orphan records are only visible to the users of group "Settings"
         automation_record_obj = self.env["automation.record"].with_user(
             self.user_automation.id
         )
         records = automation_record_obj.search(
             [("configuration_id", "=", self.configuration.id), ("is_test", "=", False)]
         )
+        self.assertEqual(len(records), 2)
         records = self.env["automation.record"].search(
             [("configuration_id", "=", self.configuration.id), ("is_test", "=", False)]
         )
-        self.configuration._compute_record_count()
+        self.configuration._compute_counters()
         self.assertEqual(len(records), 2, "Seems like no orphan record was created")
         orphan_record_found = any(record.name == "Orphan Record" for record in records)
         self.assertTrue(
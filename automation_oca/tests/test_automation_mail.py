@@ -1,12 +1,22 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-from odoo import tools
+import json
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
+from freezegun import freeze_time
+from psycopg2 import IntegrityError
+
+from odoo import fields, tools
+from odoo.exceptions import ValidationError
 from odoo.tests import Form
 from odoo.tests.common import HttpCase
+from odoo.tools import mute_logger
 
 from odoo.addons.mail.tests.common import MockEmail
 
+from ..utils.links import add_shortened_link_suffix
 from .common import AutomationTestCase
 
 MAIL_TEMPLATE = """Return-Path: <whatever-2a840@postmaster.twitter.com>
@@ -73,6 +83,315 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertEqual("sent", record_activity.mail_status)
         self.assertTrue(self.partner_01.message_ids - messages_01)
 
+    def test_activity_execution_queue(self):
+        """
+        Queued emails are sent by the email queue and the step is marked as sent
+        once the email has been delivered
+        """
+        activity = self.create_mail_activity(mail_send_mode="queue")
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+            self.assertNotSentEmail()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual("done", record_activity.state)
+        self.assertEqual("queue", record_activity.mail_status)
+        mail = self.env["mail.mail"].search(
+            [("automation_record_step_id", "=", record_activity.id)]
+        )
+        self.assertEqual("outgoing", mail.state)
+        with self.mock_mail_gateway():
+            mail.send()
+            self.assertSentEmail(self.env.user.partner_id, [self.partner_01])
+        self.assertEqual("sent", record_activity.mail_status)
+
+    def test_activity_execution_queue_failed(self):
+        """
+        Queued emails that fail are marked as bounced
+        """
+        activity = self.create_mail_activity(mail_send_mode="queue")
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual("queue", record_activity.mail_status)
+        mail = self.env["mail.mail"].search(
+            [("automation_record_step_id", "=", record_activity.id)]
+        )
+        mail.write({"state": "exception"})
+        mail._postprocess_sent_message(success_pids=[], failure_type="mail_smtp")
+        self.assertEqual("bounce", record_activity.mail_status)
+
+    def test_activate_scheduled_date_by_record(self):
+        """
+        Steps get the scheduled date of their record unless it is declared
+        to be the same for all the records
+        """
+        activity = self.create_mail_activity()
+        child_activity = self.create_mail_activity(
+            parent_id=activity.id, trigger_type="mail_open"
+        )
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        step_class = type(child_activity)
+        self.assertTrue(child_activity._is_scheduled_date_record_independent())
+        with patch.object(
+            step_class,
+            "_get_record_activity_scheduled_date",
+            autospec=True,
+            side_effect=step_class._get_record_activity_scheduled_date,
+        ) as get_scheduled_date:
+            # Overrides depend on the record by default
+            self.assertFalse(child_activity._is_scheduled_date_record_independent())
+            record_activity._set_mail_open()
+        get_scheduled_date.assert_called_once_with(
+            child_activity, self.partner_01, force=True
+        )
+
+    def test_activate_scheduled_date_record_independent(self):
+        """
+        Steps whose scheduled date doesn't depend on the record compute it
+        once with an empty record
+        """
+        activity = self.create_mail_activity()
+        child_activity = self.create_mail_activity(
+            parent_id=activity.id, trigger_type="mail_open"
+        )
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        step_class = type(child_activity)
+        with (
+            patch.object(
+                step_class, "_is_scheduled_date_record_independent", return_value=True
+            ),
+            patch.object(
+                step_class,
+                "_get_record_activity_scheduled_date",
+                autospec=True,
+                side_effect=step_class._get_record_activity_scheduled_date,
+            ) as get_scheduled_date,
+        ):
+            record_activities._set_mail_open()
+        get_scheduled_date.assert_called_once_with(
+            child_activity, self.env["res.partner"], force=True
+        )
+
+    def test_message_id_batch(self):
+        """
+        Message ids are copied to the steps with the same queries for any number
+        of emails
+        """
+        activity = self.create_mail_activity(mail_send_mode="queue")
+        partners = self.partner_01 | self.partner_02
+        for index in range(3, 11):
+            partners |= self.partner_02.copy({"name": f"Demo partner {index}"})
+        self.configuration.editable_domain = f"[('id', 'in', {partners.ids})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.record.step"]._cron_automation_steps()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        mails = self.env["mail.mail"].search(
+            [("automation_record_step_id", "in", record_activities.ids)]
+        )
+        self.assertEqual(10, len(mails))
+        self.assertEqual(
+            set(mails.mapped("message_id")),
+            set(record_activities.mapped("message_id")),
+        )
+        for batch in (mails[:1], mails):
+            record_activities.write({"message_id": False})
+            self.env.flush_all()
+            self.env.invalidate_all()
+            with self.assertQueryCount(3):
+                batch._set_automation_message_ids()
+            self.assertEqual(
+                set(batch.mapped("message_id")),
+                set(batch.automation_record_step_id.mapped("message_id")),
+            )
+
+    def test_mail_queue_backpressure(self):
+        """
+        Mail steps are deferred while the email queue is full
+        """
+        activity = self.create_mail_activity()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.env["ir.config_parameter"].sudo().set_param(
+            "automation_oca.mail_queue_threshold", 1
+        )
+        self.env["mail.mail"].create(
+            {
+                "subject": "Queued",
+                "body_html": "<p>Queued</p>",
+                "email_to": "queued@example.com",
+            }
+        )
+        now = fields.Datetime.now()
+        with freeze_time(now), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+            self.assertNotSentEmail()
+        self.assertEqual("scheduled", record_activity.state)
+        self.assertEqual(now, record_activity.backpressure_date)
+        self.env["ir.config_parameter"].sudo().set_param(
+            "automation_oca.mail_queue_threshold", 0
+        )
+        with freeze_time(now + relativedelta(minutes=10)), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+            self.assertSentEmail(self.env.user.partner_id, [self.partner_01])
+        self.assertEqual("done", record_activity.state)
+        self.assertEqual(600, record_activity.backpressure_delay)
+
+    def test_mail_queue_backpressure_immediate(self):
+        """
+        Mail steps that don't wait for the cron are deferred too while the
+        email queue is full
+        """
+        self.env["ir.config_parameter"].sudo().set_param(
+            "automation_oca.mail_queue_threshold", 1
+        )
+        self.env["mail.mail"].create(
+            {
+                "subject": "Queued",
+                "body_html": "<p>Queued</p>",
+                "email_to": "queued@example.com",
+            }
+        )
+        activity = self.create_mail_activity(trigger_interval=-1)
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.configuration"].cron_automation()
+            self.assertNotSentEmail()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual("scheduled", record_activity.state)
+        self.assertTrue(record_activity.backpressure_date)
+
+    def test_mail_rate_limit(self):
+        """
+        Mail steps over the rate limit of the recipient domain are rescheduled
+        """
+        activity = self.create_mail_activity()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.mail.rate.limit"].create(
+            {"domain": "Test.com", "rate": 1, "period": "minute"}
+        )
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        now = fields.Datetime.now()
+        with freeze_time(now), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(1, len(self._mails))
+        delayed_activity = record_activities.filtered(lambda r: r.state == "scheduled")
+        self.assertEqual(1, len(delayed_activity))
+        self.assertEqual(
+            now + relativedelta(minutes=1), delayed_activity.scheduled_date
+        )
+        with freeze_time(now + relativedelta(minutes=1)), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(1, len(self._mails))
+        self.assertEqual(["done", "done"], record_activities.mapped("state"))
+
+    def test_mail_rate_limit_slots(self):
+        """
+        Steps over the rate limit are spread on the next slots of the rate limit
+        and the cron is woken up once for the first of them
+        """
+        activity = self.create_mail_activity()
+        partner_03 = self.partner_02.copy({"name": "Demo partner 3"})
+        partners = self.partner_01 | self.partner_02 | partner_03
+        self.configuration.editable_domain = f"[('id', 'in', {partners.ids})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        self.env["automation.mail.rate.limit"].create(
+            {"domain": "test.com", "rate": 1, "period": "minute"}
+        )
+        steps = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        cron = self.env.ref("automation_oca.cron_step_execute")
+        now = fields.Datetime.now()
+        with freeze_time(now), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        deferred = steps.filtered(lambda r: r.state == "scheduled")
+        self.assertEqual(2, len(deferred))
+        self.assertTrue(all(deferred.mapped("rate_limit_reserved")))
+        self.assertEqual(
+            [now + relativedelta(minutes=1), now + relativedelta(minutes=2)],
+            sorted(deferred.mapped("scheduled_date")),
+        )
+        triggers = self.env["ir.cron.trigger"].search(
+            [("cron_id", "=", cron.id), ("call_at", ">", now)]
+        )
+        self.assertEqual([now + relativedelta(minutes=1)], triggers.mapped("call_at"))
+        with freeze_time(now + relativedelta(minutes=1)), self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        self.assertEqual(1, len(self._mails))
+        self.assertEqual(1, len(steps.filtered(lambda r: r.state == "scheduled")))
+
+    def test_mail_rate_limit_server(self):
+        """
+        Rate limits are unique by domain and server, and the one of the server
+        is used before the one without server
+        """
+        rate_limit_model = self.env["automation.mail.rate.limit"]
+        mail_server = self.env["ir.mail_server"].create(
+            {"name": "Rate limit server", "smtp_host": "smtp.example.com"}
+        )
+        generic = rate_limit_model.create({"domain": "test.com", "rate": 10})
+        specific = rate_limit_model.create(
+            {"domain": "test.com", "rate": 5, "mail_server_id": mail_server.id}
+        )
+        self.assertEqual(
+            specific, rate_limit_model._get_rate_limit("test.com", mail_server)
+        )
+        self.assertEqual(
+            generic,
+            rate_limit_model._get_rate_limit("test.com", self.env["ir.mail_server"]),
+        )
+        with self.assertRaisesRegex(ValidationError, "burst"):
+            generic.burst = -1
+        with (
+            self.assertRaises(IntegrityError),
+            mute_logger("odoo.sql_db"),
+            self.env.cr.savepoint(),
+        ):
+            rate_limit_model.create({"domain": "test.com", "rate": 1})
+            rate_limit_model.flush_model()
+
     def test_bounce(self):
         """
         Now we will check the execution of scheduled activities"""
@@ -123,6 +442,72 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
                 if step["done"] and step["icon"] == "fa fa-exclamation-circle"
             ]
         )
+        # Bounced emails are not shown as sent
+        self.assertFalse(
+            [
+                step
+                for step in record_activity.step_actions
+                if step["done"] and step["icon"] == "fa fa-envelope"
+            ]
+        )
+
+    def test_bounce_bulk(self):
+        """
+        Several steps are bounced at once and their children scheduled together
+        """
+        activity = self.create_mail_activity()
+        child_activity = self.create_mail_activity(
+            parent_id=activity.id, trigger_type="mail_bounce"
+        )
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        record_child_activities = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", child_activity.id)]
+        )
+        self.assertEqual(2, len(record_child_activities))
+        self.assertFalse(any(record_child_activities.mapped("scheduled_date")))
+        record_activities._set_mail_bounced()
+        self.assertEqual(["bounce", "bounce"], record_activities.mapped("mail_status"))
+        self.assertTrue(all(record_child_activities.mapped("scheduled_date")))
+        self.assertEqual(1, len(set(record_child_activities.mapped("scheduled_date"))))
+        # Already bounced steps don't schedule their children again
+        scheduled_date = record_child_activities[0].scheduled_date
+        record_activities._set_mail_bounced()
+        self.assertEqual(scheduled_date, record_child_activities[0].scheduled_date)
+
+    def test_search_message_ids(self):
+        """
+        Message ids of other servers are discarded without searching
+        """
+        activity = self.create_mail_activity()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual(
+            record_activity,
+            self.env["automation.record.step"]._search_message_ids(
+                [record_activity.message_id, "<external-id@example.com>"]
+            ),
+        )
+        with self.assertQueryCount(0):
+            self.assertFalse(
+                self.env["automation.record.step"]._search_message_ids(
+                    ["<external-id@example.com>"]
+                )
+            )
 
     def test_reply(self):
         """
@@ -157,6 +542,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.gateway_mail_reply_wrecord(
             MAIL_TEMPLATE, self.partner_01, use_in_reply_to=True
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("reply", record_activity.mail_status)
         self.assertTrue(record_child_activity.scheduled_date)
         record_activity.invalidate_recordset()
@@ -193,11 +579,13 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertTrue(record_child_activity)
         self.assertFalse(record_child_activity.scheduled_date)
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.assertTrue(record_child_activity.scheduled_date)
         self.gateway_mail_reply_wrecord(
             MAIL_TEMPLATE, self.partner_01, use_in_reply_to=True
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("reply", record_activity.mail_status)
         self.env["automation.record.step"]._cron_automation_steps()
         self.assertEqual("rejected", record_child_activity.state)
@@ -233,6 +621,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
             ]
         )
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.assertTrue(record_child_activity.scheduled_date)
         record_activity.invalidate_recordset()
@@ -244,6 +633,109 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
             ]
         )
 
+    def test_open_events(self):
+        """
+        Tracking events are stored and applied later
+        """
+        activity = self.create_mail_activity()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertEqual(
+            tools.hmac(self.env(su=True), "automation_oca", record_activity.id),
+            record_activity._get_mail_tracking_token(),
+        )
+        response = self.url_open(record_activity._get_mail_tracking_url())
+        self.assertEqual("image/gif", response.headers["Content-Type"])
+        self.assertIn("max-age", response.headers["Cache-Control"])
+        self.url_open(record_activity._get_mail_tracking_url())
+        events = self.env["automation.tracking.event"].search(
+            [("record_step_id", "=", record_activity.id)]
+        )
+        # The second request is ignored as the step is already known as opened
+        self.assertEqual(1, len(events))
+        self.assertEqual("open", events.event_type)
+        self.assertEqual("sent", record_activity.mail_status)
+        self.env["automation.tracking.event"]._cron_process_events()
+        self.assertEqual("open", record_activity.mail_status)
+        self.assertFalse(events.exists())
+
+    def test_external_events(self):
+        """
+        Events reported by external providers are received in bulk
+        """
+        activity = self.create_mail_activity()
+        child_activity = self.create_mail_activity(
+            parent_id=activity.id, trigger_type="mail_bounce"
+        )
+        self.configuration.editable_domain = (
+            f"[('id', 'in', {(self.partner_01 | self.partner_02).ids})]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        opened_activity, bounced_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        self.assertTrue(opened_activity.message_id)
+        self.env["ir.config_parameter"].sudo().set_param(
+            "automation_oca.webhook_token", "SECRET"
+        )
+        events = json.dumps(
+            [
+                {
+                    "event": "open",
+                    "message_id": opened_activity.message_id,
+                    "timestamp": "2024-01-01T11:00:00+01:00",
+                },
+                {
+                    "event": "open",
+                    "step_id": opened_activity.id,
+                    "timestamp": 1704099600,
+                },
+                {"event": "open", "step_id": opened_activity.id},
+                {"event": "bounce", "step_id": bounced_activity.id},
+                {"event": "open", "message_id": "<unknown@example.com>"},
+                {"event": "unknown", "step_id": opened_activity.id},
+            ]
+        )
+        response = self.url_open(
+            "/automation_oca/events",
+            data=events,
+            headers={"Authorization": "Bearer WRONG"},
+        )
+        self.assertEqual(403, response.status_code)
+        response = self.url_open(
+            "/automation_oca/events",
+            data=events,
+            headers={"Authorization": "Bearer SECRET"},
+        )
+        self.assertEqual({"received": 6, "accepted": 2}, response.json())
+        self.env["automation.tracking.event"]._cron_process_events()
+        self.assertEqual("open", opened_activity.mail_status)
+        # The first date reported by the provider is kept
+        self.assertEqual(
+            fields.Datetime.to_datetime("2024-01-01 09:00:00"),
+            opened_activity.mail_opened_on,
+        )
+        self.assertEqual("bounce", bounced_activity.mail_status)
+        self.assertTrue(
+            self.env["automation.record.step"]
+            .search(
+                [
+                    ("configuration_step_id", "=", child_activity.id),
+                    ("parent_id", "=", bounced_activity.id),
+                ]
+            )
+            .scheduled_date
+        )
+
     def test_open_wrong_code(self):
         """
         We wan to ensure that the code is checked on the call
@@ -270,6 +762,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.url_open(
             f"/automation_oca/track/{record_activity.id}/INVENTED_CODE/blank.gif"
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("sent", record_activity.mail_status)
         self.assertFalse(record_child_activity.scheduled_date)
 
@@ -324,6 +817,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertTrue(record_child_activity)
         self.assertTrue(record_child_activity.scheduled_date)
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.env["automation.record.step"]._cron_automation_steps()
         self.assertEqual("rejected", record_child_activity.state)
@@ -359,6 +853,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertTrue(record_child_activity)
         self.assertFalse(record_child_activity.scheduled_date)
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.configuration.invalidate_recordset()
         self.assertEqual(0, self.configuration.click_count)
@@ -379,6 +874,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
             f"/r/{tracker.code}/au/{record_activity.id}/{record_activity._get_mail_tracking_token()}",
             allow_redirects=False,
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.assertEqual(
             1,
@@ -405,6 +901,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
             f"/r/{tracker.code}/au/{record_activity.id}/{record_activity._get_mail_tracking_token()}",
             allow_redirects=False,
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual(
             1,
             self.env["link.tracker.click"].search_count(
@@ -417,6 +914,140 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.configuration.invalidate_recordset()
         self.assertEqual(1, self.configuration.click_count)
 
+    def test_shortened_link_suffix(self):
+        """
+        Tracking information is added only to the shortened links
+        """
+        base_url = self.env["automation.record.step"].get_base_url()
+        body = (
+            f'<p>Newsletter <a href="{base_url}/r/abcd">Offer</a> '
+            f"<a href='{base_url}/r/efgh'>Other</a> "
+            '<a href="https://www.example.com/page/r/abcd">External</a> '
+            '<a href="https://www.example.com/page">External</a> '
+            '<a href="mailto:info@example.com">Mail</a></p>'
+        )
+        self.assertEqual(
+            f'<p>Newsletter <a href="{base_url}/r/abcd/au/1/TOKEN">Offer</a> '
+            f"<a href='{base_url}/r/efgh/au/1/TOKEN'>Other</a> "
+            '<a href="https://www.example.com/page/r/abcd">External</a> '
+            '<a href="https://www.example.com/page">External</a> '
+            '<a href="mailto:info@example.com">Mail</a></p>',
+            add_shortened_link_suffix(body, "/au/1/TOKEN"),
+        )
+
+    def test_shortened_template_body(self):
+        """
+        The links of the template are shortened once for all the emails
+        """
+        self.create_mail_activity()
+        self.configuration.editable_domain = (
+            f"[('id', 'in', [{self.partner_01.id}, {self.partner_02.id}])]"
+        )
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with (
+            self.mock_mail_gateway(),
+            patch.object(
+                type(self.env["mail.render.mixin"]),
+                "_shorten_links",
+                autospec=True,
+                side_effect=type(self.env["mail.render.mixin"])._shorten_links,
+            ) as shorten_links,
+        ):
+            self.env["automation.record.step"]._cron_automation_steps()
+            bodies = "".join(mail["body"] for mail in self._mails)
+        self.assertEqual(1, shorten_links.call_count)
+        tracker = self.env["link.tracker"].search(
+            [("url", "=", "https://www.twitter.com")]
+        )
+        self.assertEqual(1, len(tracker))
+        steps = self.env["automation.record.step"].search(
+            [("configuration_id", "=", self.configuration.id)]
+        )
+        self.assertEqual(2, len(steps))
+        for step in steps:
+            self.assertIn(
+                f"/r/{tracker.code}/au/{step.id}/{step._get_mail_tracking_token()}",
+                bodies,
+            )
+
+    def test_click_duplicated(self):
+        """
+        Duplicated clicks are discarded with a single query
+        """
+        activity = self.create_mail_activity()
+        self.configuration.editable_domain = f"[('id', '=', {self.partner_01.id})]"
+        self.configuration.start_automation()
+        self.env["automation.configuration"].cron_automation()
+        with self.mock_mail_gateway():
+            self.env["automation.record.step"]._cron_automation_steps()
+        record_activity = self.env["automation.record.step"].search(
+            [("configuration_step_id", "=", activity.id)]
+        )
+        tracker = self.env["link.tracker"].search(
+            [("url", "=", "https://www.twitter.com")]
+        )
+        click = self.env["link.tracker.click"].add_click(
+            tracker.code, ip="127.0.0.1", automation_record_step_id=record_activity.id
+        )
+        self.assertEqual(tracker, click.link_id)
+        self.assertEqual(activity, click.automation_configuration_step_id)
+        self.assertEqual(1, tracker.count)
+        with self.assertQueryCount(1):
+            self.assertFalse(
+                self.env["link.tracker.click"].add_click(
+                    tracker.code,
+                    ip="127.0.0.1",
+                    automation_record_step_id=record_activity.id,
+                )
+            )
+        self.env["automation.tracking.event"]._cron_process_events()
+        self.assertTrue(record_activity.mail_clicked_on)
+
+    def test_link_tracker_cache(self):
+        """
+        Trackers of the automation emails are reused without querying
+        """
+        link_tracker = self.env["link.tracker"].with_context(
+            automation_link_tracker_cache=True
+        )
+        vals = {"url": "https://www.example.com/cached", "label": "Cached"}
+        tracker = link_tracker.search_or_create([vals])
+        self.assertTrue(tracker)
+        with self.assertQueryCount(0):
+            self.assertEqual(tracker, link_tracker.search_or_create([dict(vals)]))
+        self.assertEqual(
+            tracker, self.env["link.tracker"].search_or_create([dict(vals)])
+        )
+
+    def test_link_tracker_code_cache(self):
+        """
+        Links of the codes are cached until the trackers change, but unknown
+        codes are searched again
+        """
+        link_tracker = self.env["link.tracker"]
+        tracker = link_tracker.create({"url": "https://www.example.com/code"})
+        self.assertEqual(
+            (False, False), link_tracker._get_automation_link("AutomationCode")
+        )
+        self.env["link.tracker.code"].create(
+            {"code": "AutomationCode", "link_id": tracker.id}
+        )
+        link = (tracker.id, tracker.redirected_url)
+        self.assertEqual(link, link_tracker._get_automation_link("AutomationCode"))
+        with self.assertQueryCount(0):
+            self.assertEqual(link, link_tracker._get_automation_link("AutomationCode"))
+        tracker.url = "https://www.example.com/other"
+        self.assertEqual(
+            (tracker.id, tracker.redirected_url),
+            link_tracker._get_automation_link("AutomationCode"),
+        )
+        self.assertIn("/other", tracker.redirected_url)
+        tracker.code_ids.filtered(lambda r: r.code == "AutomationCode").unlink()
+        self.assertEqual(
+            (False, False), link_tracker._get_automation_link("AutomationCode")
+        )
+
     def test_click_wrong_url(self):
         """
         Now we will check that no log is processed when the clicked url is malformed.
@@ -448,6 +1079,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.url_open(
             f"/r/{tracker.code}/au/{record_activity.id}/1234", allow_redirects=False
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("sent", record_activity.mail_status)
         self.assertFalse(record_child_activity.scheduled_date)
         # Now we check the case where the code is not found
@@ -455,6 +1087,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.url_open(
             f"/r/{tracker.code}/au/{record_activity.id}/{record_activity._get_mail_tracking_token()}"
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("sent", record_activity.mail_status)
         self.assertFalse(record_child_activity.scheduled_date)
 
@@ -482,6 +1115,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertTrue(record_child_activity)
         self.assertFalse(record_child_activity.scheduled_date)
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.assertTrue(record_child_activity.scheduled_date)
         self.env["automation.record.step"]._cron_automation_steps()
@@ -511,6 +1145,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
         self.assertTrue(record_child_activity)
         self.assertFalse(record_child_activity.scheduled_date)
         self.url_open(record_activity._get_mail_tracking_url())
+        self.env["automation.tracking.event"]._cron_process_events()
         self.assertEqual("open", record_activity.mail_status)
         self.assertTrue(record_child_activity.scheduled_date)
         tracker = self.env["link.tracker"].search(
@@ -520,6 +1155,7 @@ class TestAutomationMail(AutomationTestCase, MockEmail, HttpCase):
             f"/r/{tracker.code}/au/{record_activity.id}/{record_activity._get_mail_tracking_token()}",
             allow_redirects=False,
         )
+        self.env["automation.tracking.event"]._cron_process_events()
         self.env["automation.record.step"]._cron_automation_steps()
         self.assertEqual("rejected", record_child_activity.state)
 
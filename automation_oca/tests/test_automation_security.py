@@ -1,11 +1,15 @@
 # Copyright 2024 Dixmit
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from unittest.mock import patch
+
+from odoo.exceptions import AccessError
 from odoo.tests.common import users
 from odoo.tools import mute_logger
 
 from odoo.addons.mail.tests.common import mail_new_test_user
 
+from ..models.automation_record import CHECK_ACCESS_KEY
 from .common import AutomationTestCase
 
 
@@ -92,6 +96,88 @@ class TestAutomationSecurity(AutomationTestCase):
         self.assertEqual(1, len(record))
         self.assertEqual(self.partner_01, record.resource_ref)
 
+    @users("user_automation_01")
+    def test_security_pagination(self):
+        """Access is applied before paginating, so pages and counts are right"""
+        domain = [("configuration_id", "=", self.configuration.id)]
+        records = self.env["automation.record"].search(domain, order="id", limit=1)
+        self.assertEqual(self.partner_02, records.resource_ref)
+        self.assertFalse(
+            self.env["automation.record"].search(domain, order="id", offset=1, limit=1)
+        )
+        self.assertEqual(1, self.env["automation.record"].search_count(domain))
+        data = self.env["automation.record"].read_group(
+            domain, [], ["configuration_id"]
+        )
+        self.assertEqual(1, data[0]["configuration_id_count"])
+
+    @users("user_automation_01")
+    def test_security_check_access_batched(self):
+        """
+        Documents are checked once by model and operation, and records already
+        checked on the transaction are not checked again
+        """
+        records = (
+            self.env["automation.record"]
+            .sudo()
+            .search([("configuration_id", "=", self.configuration.id)])
+            .with_user(self.env.user)
+        )
+        self.assertEqual(2, len(records))
+        partner_class = type(self.env["res.partner"])
+        with (
+            patch.object(
+                partner_class,
+                "check_access",
+                autospec=True,
+                side_effect=partner_class.check_access,
+            ) as check_access,
+            patch.object(
+                partner_class,
+                "get_automation_access",
+                autospec=True,
+                side_effect=partner_class.get_automation_access,
+            ) as get_automation_access,
+        ):
+            with self.assertRaises(AccessError):
+                records.check_access("read")
+            self.assertEqual(1, check_access.call_count)
+            self.assertEqual(1, get_automation_access.call_count)
+            allowed = records.filtered(lambda r: r.sudo().res_id == self.partner_02.id)
+            allowed.check_access("read")
+            self.assertEqual(2, check_access.call_count)
+            allowed.check_access("read")
+            self.assertEqual(2, check_access.call_count)
+            # Changing the document checks the access again
+            allowed.sudo().write({"res_id": self.partner_01.id})
+            with self.assertRaises(AccessError):
+                allowed.check_access("read")
+            self.assertEqual(3, check_access.call_count)
+
+    @users("user_automation_01")
+    @mute_logger("odoo.addons.automation_oca.models.automation_record")
+    def test_security_check_access_orphan(self):
+        """Checks of the records flagged as orphan are forgotten"""
+        record = self.env["automation.record"].search(
+            [("configuration_id", "=", self.configuration.id)]
+        )
+        self.assertEqual(self.partner_02, record.resource_ref)
+
+        def get_checked():
+            return set().union(
+                *(
+                    checked
+                    for key, checked in self.env.cr.precommit.data.items()
+                    if isinstance(key, str) and key.startswith(CHECK_ACCESS_KEY)
+                )
+            )
+
+        record.check_access("read")
+        self.assertIn(record.id, get_checked())
+        self.partner_02.sudo().unlink()
+        self.env["automation.record"].sudo()._cron_flag_orphan_records()
+        self.assertNotIn(record.id, get_checked())
+
     @users("user_automation_01")
     @mute_logger("odoo.addons.automation_oca.models.automation_record")
     def test_security_deleted_record(self):
@@ -100,6 +186,7 @@ class TestAutomationSecurity(AutomationTestCase):
             [("configuration_id", "=", self.configuration.id)]
         )
         self.partner_02.unlink()
+        self.env["automation.record"].sudo()._cron_flag_orphan_records()
         record = self.env["automation.record"].search(
             [("configuration_id", "=", self.configuration.id)]
         )
@@ -1 +1,3 @@
 from . import query
+from . import links
+from . import cache
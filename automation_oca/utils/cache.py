@@ -0,0 +1,45 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import contextlib
+
+
+def _get_pending_values(cr, cache):
+    """Values added to the cache by the current transaction"""
+    return cr.precommit.data.setdefault(f"automation_oca.cache.{id(cache)}", {})
+
+
+def get_worker_cache(cr, cache, key):
+    """
+    Value of the key on a cache shared by the transactions of the worker,
+    including the values added by the current transaction.
+    Returns None when the key is not cached.
+    """
+    value = cache.get(key)
+    if value is None:
+        value = _get_pending_values(cr, cache).get(key)
+    return value
+
+
+def set_worker_cache(cr, cache, key, value):
+    """
+    Add the value to a cache shared by the transactions of the worker.
+    Values might refer to records created in the current transaction, so they
+    are shared only once it is committed, and dropped if it is rolled back.
+    """
+    pending = _get_pending_values(cr, cache)
+    if not pending:
+
+        @cr.postcommit.add
+        def share_pending_values():
+            for pending_key, pending_value in pending.items():
+                cache[pending_key] = pending_value
+
+    pending[key] = value
+
+
+def pop_worker_cache(cr, cache, key):
+    """Remove the key from the cache of the worker and of the transaction"""
+    _get_pending_values(cr, cache).pop(key, None)
+    with contextlib.suppress(KeyError):
+        del cache[key]
@@ -0,0 +1,14 @@
+# Copyright 2024 Dixmit
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import re
+
+# Links shortened by link_tracker (http(s)://<host>/r/<code>)
+SHORTENED_LINK_RE = re.compile(
+    r"""(\bhref=['"]https?://[^/'"]+/r/[a-zA-Z0-9]+)(?=['"])"""
+)
+
+
+def add_shortened_link_suffix(body, suffix):
+    """Add the suffix to all the shortened links of the body"""
+    return SHORTENED_LINK_RE.sub(lambda match: match.group(1) + suffix, body)
@@ -43,3 +43,24 @@ def add_complex_left_join(
     query.add_join("LEFT JOIN", rhs_alias, rhs_table, SQL(full_condition, *params))
 
     return rhs_alias
+
+
+def is_count_over_threshold(env, query):
+    """
+    Checks if the planner estimates that the query returns more rows than the
+    threshold defined on the parameter automation_oca.approximate_count_threshold.
+    Args:
+        env: Odoo environment
+        query: Odoo Query object of the list
+    Returns:
+        bool: False when the parameter is not set or the estimate is lower
+    """
+    threshold = int(
+        env["ir.config_parameter"]
+        .sudo()
+        .get_param("automation_oca.approximate_count_threshold", 0)
+    )
+    if threshold <= 0:
+        return False
+    env.cr.execute(SQL("EXPLAIN (FORMAT JSON) %s", query.select()))
+    return env.cr.fetchone()[0][0]["Plan"]["Plan Rows"] >= threshold